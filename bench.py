@@ -0,0 +1,544 @@
+import os
+import sys
+import glob
+import time
+import json
+import shutil
+import argparse
+import resource
+import platform
+import subprocess
+from datetime import datetime, timezone
+from io import StringIO, BytesIO
+
+TABLES_DIR = os.path.join("fixtures", "tables")
+RESULTS_DIR = "bench_results"
+BENCH_TICKERS = [
+    "JPM", "BAC", "WFC", "C",
+    "O", "PLD", "SPG", "AMT",
+    "AAPL", "MSFT", "AMZN", "GOOGL", "NVDA", "BRK-B", "XOM", "KO",
+    "ACN", "MDT", "LIN", "CB",
+]
+WORK_FILES = ["tickers.txt", "excel python donusum.txt"]
+IMPORT_BUDGET_MS = 150
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "selenium", "bs4", "psycopg2", "boto3", "yfinance", "requests", "pyarrow"]
+
+def load_recorded_tables(tables_dir=TABLES_DIR):
+    import replay
+    import y_oto
+    pages = []
+    for path in sorted(glob.glob(os.path.join(tables_dir, "*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            pages.append((os.path.basename(path), f.read()))
+    pages.extend(replay.iter_recorded_pages())
+    return [(name, y_oto.clean_hidden_rows_from_html(html)) for name, html in pages]
+
+def extract_all(y_oto, html, shared_rows=True):
+    extracted = {}
+    find_metric_in_df = y_oto.find_metric_in_df
+    if not shared_rows:
+        # Reference path: every lookup converts its own rows, nothing is memoised across metrics.
+        y_oto.find_metric_in_df = lambda df, kw_groups, **kw: find_metric_in_df(df, kw_groups, **{**kw, "num_rows": None})
+    try:
+        for tab_type in ("income_statement", "cash_flow", "balance_sheet"):
+            for quarter in ("Q1", "Q2", "Q3", "Q4"):
+                out = extracted.setdefault((tab_type, quarter), {})
+                y_oto.extract_metrics_from_table_html(tab_type, "", html, quarter, out)
+    finally:
+        y_oto.find_metric_in_df = find_metric_in_df
+    return extracted
+
+def bench_numbers(tables_dir=TABLES_DIR, repeat=5):
+    import pandas as pd
+    import y_oto
+    tables = load_recorded_tables(tables_dir)
+    if not tables:
+        print(f"❌ Kayıtlı tablo yok: {tables_dir}/*.html veya fixtures/chrome gerekli.")
+        return False
+    mismatches = 0
+    for name, html in tables:
+        for df in pd.read_html(StringIO(html)):
+            for row in df.values.tolist():
+                want = [y_oto.to_number(c) for c in row]
+                nums = y_oto.NumberRow(row)
+                views = [list(nums[::-1])[::-1], [nums[i] for i in range(len(row))], list(nums[1:]), list(nums)]
+                if views != [want, want, want[1:], want]:
+                    mismatches += 1
+                    print(f"❌ {name}: NumberRow {views[1]} != to_number {want}")
+    t_shared = t_fresh = 0.0
+    for name, html in tables:
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            shared = extract_all(y_oto, html, True)
+        t_shared += (time.perf_counter() - t0) / repeat
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fresh = extract_all(y_oto, html, False)
+        t_fresh += (time.perf_counter() - t0) / repeat
+        if repr(shared) != repr(fresh):
+            mismatches += 1
+            print(f"❌ {name}: paylaşılan satırlarla çıkarım farklı")
+    print(f"{len(tables)} kayıtlı tablo")
+    print(f"Çıkarım, satır başına paylaşılan dönüşüm: {t_shared * 1000 / len(tables):.1f} ms/tablo")
+    print(f"Çıkarım, her metrik kendi dönüşümü:     {t_fresh * 1000 / len(tables):.1f} ms/tablo")
+    print(f"Eşleşmeyen: {mismatches}")
+    return mismatches == 0
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return peak_rss_mb()
+
+class RssSampler:
+    # ru_maxrss is a lifetime high-water mark, so a stage's own peak is sampled while it runs.
+    def __init__(self, interval=0.01):
+        import threading
+        self.interval = interval
+        self.start = self.peak = current_rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+def run_stage(results, name, fn, check=False):
+    # With check=True a falsy return counts as an error: create_final2/upload_to_db report failure that way.
+    import replay
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    error = None
+    with RssSampler() as rss:
+        try:
+            if not fn() and check:
+                error = "sonuç yok"
+        except (Exception, SystemExit, replay.FixtureMissing) as e:
+            error = f"{type(e).__name__}: {e}"
+    results.append({
+        "stage": name,
+        "wall_s": round(time.perf_counter() - wall0, 4),
+        "cpu_s": round(time.process_time() - cpu0, 4),
+        "peak_rss_mb": round(rss.peak, 1),
+        "rss_delta_mb": round(rss.peak - rss.start, 1),
+        "error": error,
+    })
+
+def prepare_work_dir(work_dir):
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(work_dir, exist_ok=True)
+    for fname in WORK_FILES:
+        shutil.copy(os.path.join(repo_dir, fname), os.path.join(work_dir, fname))
+    sys.path.insert(0, repo_dir)
+
+def run_pipeline(tickers, mode, work_dir):
+    # y_oto picks up REPLAY_MODE at import time, so it is imported only after the mode is set.
+    os.environ["REPLAY_MODE"] = mode
+    os.environ.setdefault("FIXTURES_DIR", os.path.abspath("fixtures"))
+    os.environ.setdefault("REPLAY_WORK_DIR", os.path.abspath(os.path.join(work_dir, "replay")))
+    # Every benchmark run measures the full pipeline; resuming from the run journal would skip the work.
+    os.environ.setdefault("RUN_JOURNAL", "")
+    # Parsing, matching and formulas stay in this process, so cpu_s and RSS include them; pool workers
+    # would show up in neither process_time() nor this process's memory.
+    os.environ["CPU_WORKERS"] = "1"
+    prepare_work_dir(work_dir)
+    os.chdir(work_dir)
+    import replay
+    import y_oto
+    if mode == "record":
+        replay.write_manifest()
+    report = []
+    for ticker in tickers:
+        stages = []
+        # Called directly rather than through trigger.txt, which the production poller watches.
+        run_stage(stages, "process_ticker", lambda: y_oto.process_ticker(ticker))
+        run_stage(stages, "create_final2", lambda: y_oto.create_final2_file_for_ticker(ticker), check=True)
+        run_stage(stages, "upload_to_db", lambda: y_oto.upload_to_db(ticker), check=True)
+        report.append({"ticker": ticker, "stages": stages})
+        total = sum(st["wall_s"] for st in stages)
+        print(f"⏱️ {ticker}: {total:.2f} sn, peak RSS {max(st['peak_rss_mb'] for st in stages)} MB")
+    import instrument
+    instrument.flush()
+    return report
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   self [us] | cumulative | imported package"; names keep their tree indent.
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+def bench_importtime(module="y_oto", repeat=5, budget_ms=IMPORT_BUDGET_MS):
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    totals = []
+    modules = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=repo_dir, capture_output=True, text=True, check=True)
+        modules = parse_importtime(proc.stderr)
+        totals.append(next(cum for name, _, cum in modules if name == module) / 1000)
+    totals.sort()
+    median = totals[len(totals) // 2]
+    loaded = {name for name, _, _ in modules}
+    heavy = [m for m in HEAVY_MODULES if m in loaded]
+    print(f"import {module}: medyan {median:.1f} ms (min {totals[0]:.1f}, max {totals[-1]:.1f}), bütçe {budget_ms} ms")
+    print("En ağır 10 modül (kümülatif):")
+    for name, _, cum in sorted(modules, key=lambda m: -m[2])[:10]:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+    if heavy:
+        print(f"❌ Başlangıçta yüklenen ağır bağımlılıklar: {', '.join(heavy)}")
+    return median <= budget_ms and not heavy
+
+def start_local_server(handler_cls):
+    from http.server import ThreadingHTTPServer
+    import threading
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_stand_in_proxy(per_ip_rate, extra_latency=0.0, broken=False):
+    # A forward proxy that enforces its own per-IP budget the way Yahoo does: over budget -> 429.
+    import urllib.request
+    from http.server import BaseHTTPRequestHandler
+    import proxy_pool
+    bucket = proxy_pool.TokenBucket(per_ip_rate, per_ip_rate)
+
+    class StandInProxy(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(extra_latency)
+            if broken:
+                self.send_response(502)
+                self.end_headers()
+                return
+            if bucket.wait_time() > 0:
+                self.send_response(429)
+                self.end_headers()
+                return
+            bucket.take()
+            with urllib.request.urlopen(self.path) as resp:
+                body = resp.read()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return start_local_server(StandInProxy)
+
+def bench_proxies(n_proxies=8, n_broken=2, per_ip_rate=5.0, n_requests=400, threads=16):
+    import requests
+    from http.server import BaseHTTPRequestHandler
+    from concurrent.futures import ThreadPoolExecutor
+    import proxy_pool
+    proxy_pool.PROXY_COOLDOWN = 5.0
+
+    class Origin(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(0.02)
+            body = b"ok"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    origin = start_local_server(Origin)
+    url = f"http://127.0.0.1:{origin.server_port}/quote"
+    servers = [start_stand_in_proxy(per_ip_rate, extra_latency=0.01 * (i % 3), broken=i < n_broken)
+               for i in range(n_proxies)]
+    urls = [f"http://127.0.0.1:{srv.server_port}" for srv in servers]
+
+    def run(get):
+        ok = limited = 0
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(threads) as ex:
+            for status in ex.map(get, range(n_requests)):
+                ok += status == 200
+                limited += status == 429
+        wall = time.perf_counter() - t0
+        return {"ok": ok, "429": limited, "wall_s": round(wall, 2), "ok_per_s": round(ok / wall, 1)}
+
+    # The baseline gets its own proxy: draining a pool member's budget here would hand the pool 429s.
+    single_server = start_stand_in_proxy(per_ip_rate)
+    single = f"http://127.0.0.1:{single_server.server_port}"
+    direct = run(lambda i: requests.get(url, proxies={"http": single}).status_code)
+    # Budget each proxy a little under the remote per-IP limit, as PROXY_RATE should be set in production.
+    pool = proxy_pool.ProxyPool(urls, rate=per_ip_rate * 0.9, burst=1)
+
+    def pooled(i):
+        try:
+            return pool.call(f"T{i % 40}", lambda: requests.get(
+                url, proxies=proxy_pool.current_proxy().as_requests_proxies()), lambda r: r.status_code == 200).status_code
+        except proxy_pool.NoHealthyProxy:
+            return None
+    pooled_result = run(pooled)
+    pooled_result["healthy"] = pool.healthy_count()
+    print(f"Tek proxy (havuzsuz): {direct}")
+    print(f"Proxy havuzu ({n_proxies} proxy, {n_broken} bozuk): {pooled_result}")
+    for srv in servers + [single_server, origin]:
+        srv.shutdown()
+    return pooled_result["429"] == 0 and pooled_result["ok_per_s"] > direct["ok_per_s"]
+
+def git_version():
+    try:
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir, text=True).strip()
+    except Exception:
+        return None
+
+def bench_pipeline(tickers, mode="replay", work_dir="bench_work", out_dir=RESULTS_DIR):
+    out_dir = os.path.abspath(out_dir)
+    report = run_pipeline(tickers, mode, work_dir)
+    result = {
+        "version": git_version(),
+        "mode": mode,
+        "python": platform.python_version(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "tickers": report,
+        "totals": {
+            "wall_s": round(sum(st["wall_s"] for t in report for st in t["stages"]), 4),
+            "cpu_s": round(sum(st["cpu_s"] for t in report for st in t["stages"]), 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "errors": sum(1 for t in report for st in t["stages"] if st["error"]),
+        },
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    out_path = os.path.join(out_dir, datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"📊 Sonuçlar yazıldı: {out_path}")
+    return result
+
+SAMPLE_RECORDED_AT = "2024-08-15"
+SAMPLE_COMPANIES = {
+    # ticker: (scale, sector, industry, employees)
+    "AAPL": (85_000, "Technology", "Consumer Electronics", 161_000),
+    "MSFT": (64_000, "Technology", "Software - Infrastructure", 228_000),
+    "KO": (12_000, "Consumer Defensive", "Beverages - Non-Alcoholic", 79_100),
+}
+
+def sample_statement_html(title, unit, headers, rows):
+    # Same shape as the SEC viewer R pages: period header rows, then label + one cell per period.
+    def fmt(v):
+        if isinstance(v, str):
+            return v
+        text = f"{abs(v):,.2f}" if isinstance(v, float) else f"{abs(v):,}"
+        return f"({text})" if v < 0 else text
+    spans = "".join(f'<th class="th" colspan="{n}">{text}</th>' for text, n in headers[0])
+    out = [f'<table class="report" border="0" cellspacing="2">',
+           f'<tr><th class="tl" rowspan="2"><div><strong>{title} - USD ($)<br/>{unit}</strong></div></th>{spans}</tr>',
+           "<tr>" + "".join(f'<th class="th"><div>{d}</div></th>' for d in headers[1]) + "</tr>"]
+    for label, values in rows:
+        if values is None:
+            out.append(f'<tr class="re"><td class="pl"><strong>{label}</strong></td>' + '<td class="text"></td>' * len(headers[1]) + "</tr>")
+            continue
+        cells = "".join(f'<td class="nump">{"$ " if i == 0 and not isinstance(v, str) else ""}{fmt(v)}</td>' for i, v in enumerate(values))
+        out.append(f'<tr class="ro"><td class="pl">{label}</td>{cells}</tr>')
+    out.append("</table>")
+    return "\n".join(out)
+
+def sample_statements(ticker, scale):
+    import random
+    rnd = random.Random(ticker)
+    def series(base, n):
+        return [int(base * rnd.uniform(0.85, 1.15)) for _ in range(n)]
+    sales = series(scale, 4)
+    cost = [int(s * rnd.uniform(0.5, 0.6)) for s in sales]
+    gross = [s - c for s, c in zip(sales, cost)]
+    opex = [int(s * rnd.uniform(0.12, 0.18)) for s in sales]
+    ebit = [g - o for g, o in zip(gross, opex)]
+    interest = series(scale * 0.004, 4)
+    other = [rnd.randint(-200, 200) for _ in range(4)]
+    tax = [int((e + o) * 0.16) for e, o in zip(ebit, other)]
+    net = [e + o - t for e, o, t in zip(ebit, other, tax)]
+    shares = [15_300_000 * scale // 85_000] * 4
+    eps = [round(n * 1000 / s, 2) for n, s in zip(net, shares)]
+    income = sample_statement_html(
+        "CONDENSED CONSOLIDATED STATEMENTS OF OPERATIONS", "shares in Thousands, $ in Millions",
+        [[("3 Months Ended", 2), ("6 Months Ended", 2)], ["Jun. 29, 2024", "Jul. 01, 2023"] * 2],
+        [("Net sales", sales), ("Cost of sales", cost), ("Gross margin", gross),
+         ("Research and development", opex), ("Operating income", ebit), ("Interest expense", [-i for i in interest]),
+         ("Other income/(expense), net", other), ("Provision for income taxes", tax), ("Net income", net),
+         ("Earnings per share:", None), ("Basic (in dollars per share)", eps),
+         ("Shares used in computing earnings per share:", None), ("Basic (in shares)", shares)])
+    assets = series(scale * 4, 2)
+    balance_rows = [("Current assets:", None),
+                    ("Cash and cash equivalents", series(scale * 0.4, 2)),
+                    ("Accounts receivable, net", series(scale * 0.25, 2)),
+                    ("Inventories", series(scale * 0.08, 2)),
+                    ("Prepaid expenses and other current assets", series(scale * 0.1, 2)),
+                    ("Property, plant and equipment, net", series(scale * 0.5, 2)),
+                    ("Operating lease right-of-use assets", series(scale * 0.12, 2)),
+                    ("Total assets", assets),
+                    ("Current liabilities:", None),
+                    ("Accounts payable", series(scale * 0.6, 2)),
+                    ("Accrued expenses", series(scale * 0.3, 2)),
+                    ("Deferred revenue", series(scale * 0.1, 2)),
+                    ("Operating lease liabilities", series(scale * 0.11, 2)),
+                    ("Total shareholders' equity", [int(a * 0.2) for a in assets]),
+                    ("Total liabilities and shareholders' equity", assets)]
+    balance = sample_statement_html(
+        "CONDENSED CONSOLIDATED BALANCE SHEETS", "$ in Millions",
+        [[("", 2)], ["Jun. 29, 2024", "Sep. 30, 2023"]], balance_rows)
+    cash_flow = sample_statement_html(
+        "CONDENSED CONSOLIDATED STATEMENTS OF CASH FLOWS", "$ in Millions",
+        [[("6 Months Ended", 2)], ["Jun. 29, 2024", "Jul. 01, 2023"]],
+        [("Operating activities:", None),
+         ("Net income", [sum(net[2:]), sum(net[:2])]),
+         ("Depreciation and amortization", series(scale * 0.06, 2)),
+         ("Cash generated by operating activities", series(scale * 0.6, 2)),
+         ("Investing activities:", None),
+         ("Payments for acquisition of property, plant and equipment", [-v for v in series(scale * 0.05, 2)]),
+         ("Payments related to acquisitions of businesses, net", [-v for v in series(scale * 0.01, 2)]),
+         ("Financing activities:", None),
+         ("Payments for dividends and dividend equivalents", [-v for v in series(scale * 0.09, 2)]),
+         ("Supplemental cash flow disclosure:", None),
+         ("Cash paid for income taxes, net", series(scale * 0.12, 2)),
+         ("Cash paid for interest", series(scale * 0.003, 2))])
+    return [("CONDENSED CONSOLIDATED STATEMENTS OF OPERATIONS (Unaudited)", income),
+            ("CONDENSED CONSOLIDATED BALANCE SHEETS (Unaudited)", balance),
+            ("CONDENSED CONSOLIDATED STATEMENTS OF CASH FLOWS (Unaudited)", cash_flow)]
+
+def sample_history(code, start, end, price):
+    import random
+    import pandas as pd
+    rnd = random.Random(code)
+    dates = pd.bdate_range(start, end, inclusive="left", name="Date")
+    closes = []
+    for _ in dates:
+        price *= 1 + rnd.gauss(0.0004, 0.015)
+        closes.append(round(price, 2))
+    return pd.DataFrame({"Close": closes, "Volume": [rnd.randint(10**6, 10**8) for _ in dates]}, index=dates)
+
+def sample_template():
+    import openpyxl
+    from openpyxl.styles import Font, PatternFill
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Final2"
+    ws["A40"], ws["B40"], ws["C40"] = "Tarih", "Şirket", "Endeks"
+    ws["E40"], ws["F40"], ws["G40"], ws["H40"], ws["I40"] = "Sektör", "Endüstri", "Çalışan", "Özet", "Bilanço tarihi"
+    ws["E44"], ws["F44"] = "Beta", "10Y"
+    for cell in ws[40]:
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill("solid", fgColor="DDEBF7")
+    for row in range(41, 108):
+        ws[f"B{row}"].number_format = ws[f"C{row}"].number_format = "#,##0.00"
+    ws.column_dimensions["A"].width = 14
+    ws.freeze_panes = "A41"
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def write_sample_fixtures(fixtures_dir, recorded_at=SAMPLE_RECORDED_AT):
+    # Live SEC/Yahoo are not reachable everywhere the bench runs, so a small deterministic set in the
+    # recorded format is generated here; `bench.py record` replaces it with real recordings.
+    from datetime import date, timedelta
+    fixtures_dir = os.path.abspath(fixtures_dir)
+    os.makedirs(fixtures_dir, exist_ok=True)
+    with open(os.path.join(fixtures_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"recorded_at": recorded_at, "sample": True}, f)
+    os.environ["REPLAY_MODE"] = "replay"
+    os.environ["FIXTURES_DIR"] = fixtures_dir
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import replay
+    import y_oto
+    replay.FIXTURES_DIR = fixtures_dir
+    by_ticker, _ = y_oto.load_ticker_index(os.path.join(os.path.dirname(os.path.abspath(__file__)), "tickers.txt"))
+    curr_date, min_date = y_oto.price_window()
+    start, end = min_date.strftime("%Y-%m-%d"), (curr_date + timedelta(days=1)).strftime("%Y-%m-%d")
+    for n, (ticker, (scale, sector, industry, employees)) in enumerate(SAMPLE_COMPANIES.items()):
+        cik = by_ticker[ticker]
+        acc = f"{cik}-24-{81 + n:06d}"
+        submissions = {"filings": {"recent": {
+            "form": ["8-K", "10-Q", "10-Q", "10-K"],
+            "accessionNumber": [f"{cik}-24-{90 + n:06d}", acc, f"{cik}-24-{40 + n:06d}", f"{cik}-23-{100 + n:06d}"],
+            "reportDate": ["2024-07-30", "2024-06-29", "2024-03-30", "2023-09-30"],
+        }}}
+        url = f"https://data.sec.gov/submissions/CIK{cik}.json"
+        replay.save_fixture("http", url, replay.RecordedResponse(
+            url, 200, "OK", {"Content-Type": "application/json"}, json.dumps(submissions).encode("utf-8")))
+        replay.save_fixture("chrome", replay.driver_fixture_key(y_oto.get_sec_html_url(cik, acc.replace("-", ""))), {
+            "cover": "<table><tr><td>Document Fiscal Year Focus</td><td>2024</td></tr>"
+                     "<tr><td>Document Fiscal Period Focus</td><td>Q2</td></tr></table>",
+            "links": [{"text": text, "page_source": html} for text, html in sample_statements(ticker, scale)],
+        })
+        replay.save_fixture("yf_history", (ticker, start, end), sample_history(ticker, start, end, scale / 500))
+        replay.save_fixture("yf_info", ticker, {
+            "sector": sector, "industry": industry, "fullTimeEmployees": employees,
+            "longBusinessSummary": f"{ticker} örnek şirket özeti.", "beta": round(0.6 + n * 0.3, 2)})
+        replay.save_fixture("yf_calendar", ticker, {"Earnings Date": [date(2024, 10, 31)]})
+    replay.save_fixture("yf_history", ("^GSPC", start, end), sample_history("^GSPC", start, end, 3800.0))
+    replay.save_fixture("yf_info", "^TNX", {"regularMarketPrice": 4.21})
+    template_path = os.path.join(fixtures_dir, "s3", "Companies1", "donusturucu.xlsx")
+    os.makedirs(os.path.dirname(template_path), exist_ok=True)
+    with open(template_path, "wb") as f:
+        f.write(sample_template())
+    print(f"🧪 Örnek fixture seti yazıldı: {fixtures_dir} ({', '.join(SAMPLE_COMPANIES)})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="tarama benchmark araçları")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_num = sub.add_parser("numbers", help="Kayıtlı tablolarda NumberRow ile to_number eşdeğerliği ve çıkarım süresi")
+    p_num.add_argument("--tables", default=TABLES_DIR)
+    p_num.add_argument("--repeat", type=int, default=5)
+    p_imp = sub.add_parser("importtime", help="python -X importtime ile başlangıç süresi ve bütçe kontrolü")
+    p_imp.add_argument("--module", default="y_oto")
+    p_imp.add_argument("--repeat", type=int, default=5)
+    p_imp.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    p_proxy = sub.add_parser("proxies", help="Yerel sahte proxy'lerle proxy havuzu ölçümü")
+    p_proxy.add_argument("--proxies", type=int, default=8)
+    p_proxy.add_argument("--broken", type=int, default=2)
+    p_proxy.add_argument("--rate", type=float, default=5.0)
+    p_proxy.add_argument("--requests", type=int, default=400)
+    p_sample = sub.add_parser("sample-fixtures", help="Canlı servis olmadan deterministik örnek fixture seti")
+    p_sample.add_argument("--fixtures", default="fixtures")
+    for name, help_text in [("pipeline", "Kayıtlı fixture'larla uçtan uca ölçüm"),
+                            ("record", "Canlı servislerden fixture kaydı")]:
+        p = sub.add_parser(name, help=help_text)
+        # Until the full set is recorded, replay defaults to the tickers the committed fixtures cover.
+        p.add_argument("--tickers", nargs="*", default=BENCH_TICKERS if name == "record" else list(SAMPLE_COMPANIES))
+        p.add_argument("--work-dir", default="bench_work")
+        p.add_argument("--out", default=RESULTS_DIR)
+    args = parser.parse_args(argv)
+    if args.cmd == "numbers":
+        ok = bench_numbers(args.tables, args.repeat)
+        return 0 if ok else 1
+    if args.cmd == "importtime":
+        ok = bench_importtime(args.module, args.repeat, args.budget_ms)
+        return 0 if ok else 1
+    if args.cmd == "proxies":
+        ok = bench_proxies(args.proxies, args.broken, args.rate, args.requests)
+        return 0 if ok else 1
+    if args.cmd == "sample-fixtures":
+        write_sample_fixtures(args.fixtures)
+        return 0
+    if args.cmd in ("pipeline", "record"):
+        mode = "replay" if args.cmd == "pipeline" else "record"
+        result = bench_pipeline(args.tickers, mode, args.work_dir, args.out)
+        return 0 if mode == "record" or not result["totals"]["errors"] else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
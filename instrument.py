@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
+import resource
+import zlib
+import io
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.prom")
+METRICS_LOG = os.getenv("METRICS_LOG", "metrics.jsonl")
+METRICS_PORT = os.getenv("METRICS_PORT")
+PROFILE = os.getenv("PROFILE", "")
+PROFILE_SAMPLE = int(os.getenv("PROFILE_SAMPLE", "1"))
+PROFILE_STAGES = os.getenv("PROFILE_STAGES", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_S3 = os.getenv("PROFILE_S3", "0") == "1"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_LOCK = threading.Lock()
+_COUNTERS = {}
+_GAUGES = {}
+_HISTOGRAMS = {}
+_HELP = {
+    "tarama_http_requests_total": "SEC/Yahoo HTTP istekleri",
+    "tarama_http_backoff_total": "Rate-limit ve bağlantı backoff sayısı",
+    "tarama_s3_ops_total": "S3 işlemleri",
+    "tarama_db_rows_total": "Veritabanına yazılan satırlar",
+    "tarama_stage_total": "Tamamlanan aşama sayısı",
+    "tarama_stage_seconds": "Aşama süresi (saniye)",
+    "tarama_peak_rss_bytes": "Süreç tepe RSS (bayt)",
+}
+_SERVER = None
+_PROFILE_LOCK = threading.Lock()
+_PROFILE_THREAD = None
+_PROFILE_UPLOADER = None
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    with _LOCK:
+        k = _key(name, labels)
+        _COUNTERS[k] = _COUNTERS.get(k, 0) + value
+
+def set_gauge(name, value, **labels):
+    with _LOCK:
+        _GAUGES[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    with _LOCK:
+        k = _key(name, labels)
+        h = _HISTOGRAMS.setdefault(k, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                h["buckets"][i] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+def peak_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def log_event(event, **fields):
+    record = {"ts": datetime.now(timezone.utc).isoformat(), "event": event, **fields}
+    line = json.dumps(record, default=str, ensure_ascii=False)
+    if not METRICS_LOG:
+        return
+    with _LOCK:
+        with open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def enable_profiling(tickers="1", sample=None, stages=None):
+    global PROFILE, PROFILE_SAMPLE, PROFILE_STAGES
+    PROFILE = tickers
+    if sample is not None:
+        PROFILE_SAMPLE = int(sample)
+    if stages is not None:
+        PROFILE_STAGES = stages
+
+def set_profile_uploader(fn):
+    global _PROFILE_UPLOADER
+    _PROFILE_UPLOADER = fn
+
+def should_profile(stage, ticker):
+    if not PROFILE or not ticker:
+        return False
+    if PROFILE.lower() not in ("1", "all") and ticker.upper() not in {t.strip().upper() for t in PROFILE.split(",")}:
+        return False
+    # crc32 rather than hash() so the 1-in-N sample is stable across processes and every stage of a ticker is kept.
+    if PROFILE_SAMPLE > 1 and zlib.crc32(ticker.upper().encode("utf-8")) % PROFILE_SAMPLE != 0:
+        return False
+    if PROFILE_STAGES and stage not in {s.strip() for s in PROFILE_STAGES.split(",")}:
+        return False
+    return True
+
+def _write_profile(ticker, stage, prof, snapshot, traced_peak):
+    name = f"{stage}-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}"
+    out = io.StringIO()
+    stats = pstats.Stats(prof, stream=out)
+    stats.sort_stats("cumulative").print_stats(40)
+    out.write(f"\n=== tracemalloc: en çok bellek ayıran 25 satır (tepe {traced_peak / 1048576:.1f} MB) ===\n")
+    for stat in snapshot.statistics("lineno")[:25]:
+        out.write(f"{stat}\n")
+    out_dir = os.path.join(PROFILE_DIR, ticker)
+    os.makedirs(out_dir, exist_ok=True)
+    prof_path = os.path.join(out_dir, name + ".prof")
+    txt_path = os.path.join(out_dir, name + ".txt")
+    stats.dump_stats(prof_path)
+    with open(txt_path, "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
+    if PROFILE_S3 and _PROFILE_UPLOADER is not None:
+        for path in (prof_path, txt_path):
+            with open(path, "rb") as f:
+                _PROFILE_UPLOADER(f"{PROFILE_DIR}/{ticker}/{os.path.basename(path)}", f.read())
+    print(f"🔬 Profil yazıldı: {txt_path}")
+
+@contextmanager
+def profiled(stage, ticker):
+    # tracemalloc is process-wide and cProfile cannot nest, so one profiled block runs per process;
+    # blocks that overlap it (other threads, nested stages) run unprofiled.
+    global _PROFILE_THREAD
+    if not should_profile(stage, ticker) or not _PROFILE_LOCK.acquire(blocking=False):
+        yield
+        return
+    _PROFILE_THREAD = threading.get_ident()
+    started_tracing = False
+    prof = None
+    try:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(25)
+        tracemalloc.reset_peak()
+        prof = cProfile.Profile()
+        prof.enable()
+        yield
+    finally:
+        try:
+            if prof is not None:
+                prof.disable()
+                snapshot = tracemalloc.take_snapshot()
+                traced_peak = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+                _write_profile(ticker, stage, prof, snapshot, traced_peak)
+        except Exception as e:
+            print(f"🔬 Profil yazılamadı: {ticker}/{stage} => {e}")
+        finally:
+            if started_tracing and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            _PROFILE_THREAD = None
+            _PROFILE_LOCK.release()
+
+def profiling():
+    # True inside the block being profiled; CPU-pool work is then kept in this thread so cProfile and
+    # tracemalloc see it instead of a wait on a future.
+    return _PROFILE_THREAD == threading.get_ident()
+
+@contextmanager
+def span(stage, profile=True, **fields):
+    # fields (e.g. ticker) go to the JSON log only; Prometheus series stay keyed by stage.
+    # profile=False for spans that stay open across awaits: cProfile would only see the event loop.
+    wall0, cpu0 = time.perf_counter(), time.thread_time()
+    status = "ok"
+    try:
+        with profiled(stage, fields.get("ticker") if profile else None):
+            yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        wall = time.perf_counter() - wall0
+        rss = peak_rss_bytes()
+        observe("tarama_stage_seconds", wall, stage=stage)
+        inc("tarama_stage_total", stage=stage, status=status)
+        set_gauge("tarama_peak_rss_bytes", rss)
+        log_event("span", stage=stage, status=status, wall_s=round(wall, 4),
+                  cpu_s=round(time.thread_time() - cpu0, 4), peak_rss_mb=round(rss / 1048576, 1), **fields)
+
+def drain():
+    # Counters and histograms recorded in this process since the last drain, cleared afterwards.
+    # Pool workers hand these to the parent, which merges them into its own series.
+    with _LOCK:
+        data = {"counters": dict(_COUNTERS), "histograms": dict(_HISTOGRAMS)}
+        _COUNTERS.clear()
+        _HISTOGRAMS.clear()
+    return data
+
+def merge(data):
+    with _LOCK:
+        for k, value in data["counters"].items():
+            _COUNTERS[k] = _COUNTERS.get(k, 0) + value
+        for k, h in data["histograms"].items():
+            cur = _HISTOGRAMS.setdefault(k, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            cur["buckets"] = [a + b for a, b in zip(cur["buckets"], h["buckets"])]
+            cur["sum"] += h["sum"]
+            cur["count"] += h["count"]
+
+def _fmt_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+def render_prometheus():
+    lines = []
+    seen = set()
+    def header(name, kind):
+        if name in seen:
+            return
+        seen.add(name)
+        if name in _HELP:
+            lines.append(f"# HELP {name} {_HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+    with _LOCK:
+        for (name, labels), value in sorted(_COUNTERS.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        for (name, labels), value in sorted(_GAUGES.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_fmt_labels(labels)} {value}")
+        for (name, labels), h in sorted(_HISTOGRAMS.items()):
+            header(name, "histogram")
+            for bound, count in zip(BUCKETS, h["buckets"]):
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {h['sum']}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path=None):
+    path = path or METRICS_FILE
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+
+def start_metrics_server(port):
+    global _SERVER
+    if _SERVER is not None:
+        return _SERVER
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    _SERVER = ThreadingHTTPServer(("0.0.0.0", int(port)), MetricsHandler)
+    threading.Thread(target=_SERVER.serve_forever, daemon=True).start()
+    print(f"📈 Metrik sunucusu :{port}/metrics")
+    return _SERVER
+
+def flush():
+    set_gauge("tarama_peak_rss_bytes", peak_rss_bytes())
+    write_prometheus()
+
+# Pool workers import this module too; only the main process serves metrics.
+if METRICS_PORT and multiprocessing.current_process().name == "MainProcess":
+    start_metrics_server(METRICS_PORT)
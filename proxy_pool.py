@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import threading
+from urllib.parse import urlparse
+import instrument
+
+PROXY_FILE = os.getenv("PROXY_FILE", "proxyler.txt")
+USE_PROXIES = os.getenv("USE_PROXIES", "0") == "1"
+PROXY_RATE = float(os.getenv("PROXY_RATE", "1"))
+PROXY_BURST = float(os.getenv("PROXY_BURST", "3"))
+PROXY_MAX_ERRORS = int(os.getenv("PROXY_MAX_ERRORS", "3"))
+PROXY_COOLDOWN = float(os.getenv("PROXY_COOLDOWN", "300"))
+LATENCY_ALPHA = 0.3
+
+_LEASE = threading.local()
+
+class NoHealthyProxy(Exception):
+    pass
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        with self.lock:
+            self._refill()
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Proxy:
+    def __init__(self, url, rate, burst):
+        self.url = url
+        self.bucket = TokenBucket(rate, burst)
+        self.latency = None
+        self.errors = 0
+        self.requests = 0
+        self.failures = 0
+        self.evicted_until = 0.0
+        self.probing = False
+        self.pending = 0
+
+    @property
+    def label(self):
+        parsed = urlparse(self.url)
+        return f"{parsed.hostname}:{parsed.port}"
+
+    def score(self):
+        # Lower is better: smoothed latency inflated by the lifetime error rate.
+        # Proxies without a latency sample yet score as average so they get tried.
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + 4 * self.failures / max(self.requests, 1))
+
+    def available(self, now):
+        return self.evicted_until <= now and not self.probing
+
+    def as_requests_proxies(self):
+        return {"http": self.url, "https": self.url}
+
+class ProxyPool:
+    def __init__(self, urls, rate=PROXY_RATE, burst=PROXY_BURST):
+        self.proxies = [Proxy(url, rate, burst) for url in dict.fromkeys(urls)]
+        self.sticky = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path=PROXY_FILE, **kwargs):
+        with open(path, "r", encoding="utf-8") as f:
+            urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        return cls(urls, **kwargs)
+
+    def _pick(self, key):
+        now = time.monotonic()
+        proxy = self.sticky.get(key) if key is not None else None
+        if proxy is not None and proxy.available(now):
+            return proxy
+        candidates = [p for p in self.proxies if p.available(now)]
+        if not candidates:
+            raise NoHealthyProxy("sağlıklı proxy kalmadı")
+        # Least queued first, then a proxy with a token ready, then the best score.
+        proxy = min(candidates, key=lambda p: (p.pending, p.bucket.wait_time() > 0, p.score(), random.random()))
+        if proxy.evicted_until:
+            # Cooldown is over: this request is the single re-probe that decides whether it comes back.
+            proxy.probing = True
+        if key is not None:
+            self.sticky[key] = proxy
+        return proxy
+
+    def acquire(self, key=None):
+        with self.lock:
+            proxy = self._pick(key)
+            proxy.pending += 1
+        try:
+            proxy.bucket.take()
+        finally:
+            with self.lock:
+                proxy.pending -= 1
+        return proxy
+
+    def report(self, proxy, ok, latency=None):
+        with self.lock:
+            proxy.requests += 1
+            if ok:
+                if proxy.evicted_until:
+                    print(f"✅ Proxy yeniden havuzda: {proxy.label}")
+                proxy.errors = 0
+                proxy.evicted_until = 0.0
+                proxy.probing = False
+                if latency is not None:
+                    proxy.latency = latency if proxy.latency is None else (1 - LATENCY_ALPHA) * proxy.latency + LATENCY_ALPHA * latency
+                return
+            proxy.failures += 1
+            proxy.errors += 1
+            if proxy.probing or proxy.errors >= PROXY_MAX_ERRORS:
+                proxy.evicted_until = time.monotonic() + PROXY_COOLDOWN
+                proxy.probing = False
+                for key in [k for k, p in self.sticky.items() if p is proxy]:
+                    del self.sticky[key]
+                print(f"🚫 Proxy devre dışı: {proxy.label} ({PROXY_COOLDOWN:.0f} sn)")
+                instrument.inc("tarama_proxy_evictions_total")
+
+    def healthy_count(self):
+        now = time.monotonic()
+        with self.lock:
+            return sum(1 for p in self.proxies if p.evicted_until <= now)
+
+    def call(self, key, fn, is_ok=None):
+        proxy = self.acquire(key)
+        _LEASE.proxy = proxy
+        # Set by the leased session: yfinance swallows HTTP errors, so fn() alone does not show them.
+        _LEASE.failed = False
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        except Exception:
+            self.report(proxy, False)
+            raise
+        finally:
+            _LEASE.proxy = None
+        ok = not _LEASE.failed and (is_ok(result) if is_ok else True)
+        self.report(proxy, ok, time.perf_counter() - t0)
+        return result
+
+def current_proxy():
+    return getattr(_LEASE, "proxy", None)
+
+def failed_status(status):
+    # Blocked, rate limited or upstream down: says something about the proxy, not about the request.
+    return status in (403, 407, 429) or status >= 500
+
+def make_leased_session():
+    # yfinance keeps one process-wide session, so per-request routing happens here:
+    # every request made on this session goes out through the proxy leased by the calling thread.
+    try:
+        from curl_cffi.requests import Session
+        kwargs = {"impersonate": "chrome"}
+    except ImportError:
+        from requests import Session
+        kwargs = {}
+
+    class LeasedSession(Session):
+        def request(self, method, url, *args, **kw):
+            proxy = current_proxy()
+            if proxy is not None:
+                kw["proxies"] = proxy.as_requests_proxies()
+            try:
+                resp = super().request(method, url, *args, **kw)
+            except Exception:
+                _LEASE.failed = True
+                raise
+            if failed_status(resp.status_code):
+                _LEASE.failed = True
+            return resp
+
+    return LeasedSession(**kwargs)
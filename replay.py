@@ -0,0 +1,373 @@
+import os
+import json
+import pickle
+import hashlib
+from datetime import date
+from io import BytesIO
+
+REPLAY_MODE = os.getenv("REPLAY_MODE", "").lower()
+FIXTURES_DIR = os.path.abspath(os.getenv("FIXTURES_DIR", "fixtures"))
+REPLAY_WORK_DIR = os.path.abspath(os.getenv("REPLAY_WORK_DIR", "replay_work"))
+
+# Not an Exception: the pipeline's broad "except Exception" handlers would otherwise turn a missing
+# fixture into an ordinary ticker failure and the replay would look like a successful run.
+class FixtureMissing(BaseException):
+    pass
+
+def recording():
+    return REPLAY_MODE == "record"
+
+def replaying():
+    return REPLAY_MODE == "replay"
+
+def fixture_path(kind, key, ext="pkl"):
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]
+    return os.path.join(FIXTURES_DIR, kind, f"{digest}.{ext}")
+
+def save_fixture(kind, key, value):
+    path = fixture_path(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump({"key": key, "value": value}, f)
+
+def load_fixture(kind, key):
+    path = fixture_path(kind, key)
+    if not os.path.exists(path):
+        raise FixtureMissing(f"{kind} fixture yok: {key!r}")
+    with open(path, "rb") as f:
+        return pickle.load(f)["value"]
+
+def recorded_call(kind, key, fn):
+    if replaying():
+        value = load_fixture(kind, key)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    try:
+        value = fn()
+    except Exception as e:
+        if recording():
+            save_fixture(kind, key, e)
+        raise
+    if recording():
+        save_fixture(kind, key, value)
+    return value
+
+def manifest_path():
+    return os.path.join(FIXTURES_DIR, "manifest.json")
+
+def write_manifest():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    with open(manifest_path(), "w", encoding="utf-8") as f:
+        json.dump({"recorded_at": date.today().isoformat()}, f)
+
+def frozen_today():
+    if replaying() and os.path.exists(manifest_path()):
+        with open(manifest_path(), "r", encoding="utf-8") as f:
+            return date.fromisoformat(json.load(f)["recorded_at"])
+    return date.today()
+
+class RecordedResponse:
+    def __init__(self, url, status_code, reason, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+
+    @classmethod
+    def from_response(cls, resp):
+        return cls(resp.url, resp.status_code, resp.reason, dict(resp.headers), resp.content)
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(f"{self.status_code} {self.reason}: {self.url}")
+
+def replay_http_get(url, get_fn):
+    if replaying():
+        return load_fixture("http", url)
+    resp = get_fn()
+    if recording():
+        save_fixture("http", url, RecordedResponse.from_response(resp))
+    return resp
+
+class LocalS3:
+    # Replay stand-in for the boto3 client: reads fall through to recorded objects,
+    # writes and deletes stay in REPLAY_WORK_DIR so fixtures are never modified.
+    def __init__(self, read_root, write_root):
+        self.read_root = read_root
+        self.write_root = write_root
+        self.deleted = set()
+
+    def _resolve(self, key):
+        if key in self.deleted:
+            return None
+        for root in (self.write_root, self.read_root):
+            path = os.path.join(root, key)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _read(self, key):
+        path = self._resolve(key)
+        if path is None:
+            raise FileNotFoundError(f"s3 nesnesi yok: {key}")
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _write(self, key, data):
+        path = os.path.join(self.write_root, key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        self.deleted.discard(key)
+
+    def head_object(self, Bucket, Key):
+        path = self._resolve(Key)
+        if path is None:
+            raise FileNotFoundError(f"s3 nesnesi yok: {Key}")
+        return {"ContentLength": os.path.getsize(path)}
+
+    def get_object(self, Bucket, Key):
+        return {"Body": BytesIO(self._read(Key))}
+
+    def put_object(self, Bucket, Key, Body):
+        self._write(Key, Body if isinstance(Body, bytes) else Body.read())
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.deleted.add(Key)
+        path = os.path.join(self.write_root, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None):
+        self._write(Key, Fileobj.read())
+
+    def download_fileobj(self, Bucket, Key, Fileobj, Config=None):
+        Fileobj.write(self._read(Key))
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix=""):
+        keys = set()
+        for root in (self.read_root, self.write_root):
+            for dirpath, _, files in os.walk(root):
+                for fname in files:
+                    key = os.path.relpath(os.path.join(dirpath, fname), root).replace(os.sep, "/")
+                    if key.startswith(Prefix) and key not in self.deleted:
+                        keys.add(key)
+        return [{"Contents": [{"Key": k} for k in sorted(keys)]}]
+
+class RecordingS3(LocalS3):
+    # Record-mode client: objects read from the real bucket are copied under fixtures/s3, while puts
+    # and deletes stay in REPLAY_WORK_DIR as in replay, so a recording never changes the live bucket.
+    def __init__(self, client, read_root, write_root):
+        super().__init__(read_root, write_root)
+        self.client = client
+
+    def _fetch(self, Bucket, Key):
+        if Key in self.deleted or self._resolve(Key) is not None:
+            return
+        data = self.client.get_object(Bucket=Bucket, Key=Key)["Body"].read()
+        path = os.path.join(self.read_root, Key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def head_object(self, Bucket, Key):
+        try:
+            self._fetch(Bucket, Key)
+        except Exception:
+            pass
+        return super().head_object(Bucket, Key)
+
+    def get_object(self, Bucket, Key):
+        self._fetch(Bucket, Key)
+        return super().get_object(Bucket, Key)
+
+    def download_fileobj(self, Bucket, Key, Fileobj, Config=None):
+        self._fetch(Bucket, Key)
+        super().download_fileobj(Bucket, Key, Fileobj, Config)
+
+    def paginate(self, Bucket, Prefix=""):
+        keys = {obj["Key"] for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=Bucket, Prefix=Prefix)
+                for obj in page.get("Contents", [])}
+        keys.update(obj["Key"] for obj in super().paginate(Bucket, Prefix)[0]["Contents"])
+        return [{"Contents": [{"Key": k} for k in sorted(keys - self.deleted)]}]
+
+class ReplayCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.statements.append((" ".join(sql.split()), params))
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def close(self):
+        pass
+
+class ReplayConnection:
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return ReplayCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+def driver_fixture_key(url):
+    return ("chrome", url)
+
+class RecordingElement:
+    def __init__(self, element, rec):
+        self._element = element
+        self._rec = rec
+
+    def __getattr__(self, name):
+        return getattr(self._element, name)
+
+    def click(self):
+        self._element.click()
+        if "xbrlviewer" in (self._element.get_attribute("class") or ""):
+            self._rec._select_link((self._element.text or self._element.get_attribute("innerText") or "").strip())
+
+    def find_element(self, *args):
+        return RecordingElement(self._element.find_element(*args), self._rec)
+
+    def find_elements(self, *args):
+        return self._rec._register_links([RecordingElement(e, self._rec) for e in self._element.find_elements(*args)], args)
+
+class RecordingDriver:
+    def __init__(self, driver):
+        self._driver = driver
+        self._url = None
+        self._pages = {"cover": None, "links": []}
+        self._current = None
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+    def _select_link(self, text):
+        for i, link in enumerate(self._pages["links"]):
+            if link["text"] == text:
+                self._current = i
+                return
+        self._pages["links"].append({"text": text, "page_source": None})
+        self._current = len(self._pages["links"]) - 1
+
+    def get(self, url):
+        self._url = url
+        self._current = None
+        self._driver.get(url)
+
+    @property
+    def page_source(self):
+        src = self._driver.page_source
+        if self._current is None:
+            self._pages["cover"] = src
+        else:
+            self._pages["links"][self._current]["page_source"] = src
+        return src
+
+    def find_element(self, *args):
+        return RecordingElement(self._driver.find_element(*args), self)
+
+    def _register_links(self, elements, args):
+        if args and args[-1] == "a.xbrlviewer":
+            for e in elements:
+                text = (e.text or e.get_attribute("innerText") or "").strip()
+                if not any(link["text"] == text for link in self._pages["links"]):
+                    self._pages["links"].append({"text": text, "page_source": None})
+        return elements
+
+    def find_elements(self, *args):
+        return self._register_links([RecordingElement(e, self) for e in self._driver.find_elements(*args)], args)
+
+    def quit(self):
+        if self._url is not None:
+            save_fixture("chrome", driver_fixture_key(self._url), self._pages)
+        self._driver.quit()
+
+class ReplayElement:
+    def __init__(self, driver, index, text):
+        self._driver = driver
+        self._index = index
+        self.text = text
+
+    def get_attribute(self, name):
+        if name == "innerText":
+            return self.text
+        if name == "class":
+            return "xbrlviewer"
+        return None
+
+    def click(self):
+        self._driver._current = self._index
+
+    def find_element(self, *args):
+        from selenium.common.exceptions import NoSuchElementException
+        raise NoSuchElementException("replay: eleman yok")
+
+    def find_elements(self, *args):
+        return []
+
+class ReplayDriver:
+    def __init__(self):
+        self._pages = None
+        self._current = None
+
+    def get(self, url):
+        self._pages = load_fixture("chrome", driver_fixture_key(url))
+        self._current = None
+
+    @property
+    def page_source(self):
+        if self._current is None:
+            return self._pages["cover"] or ""
+        return self._pages["links"][self._current]["page_source"] or ""
+
+    def find_element(self, by, value):
+        from selenium.common.exceptions import NoSuchElementException
+        raise NoSuchElementException(f"replay: eleman yok ({by}={value})")
+
+    def find_elements(self, by, value):
+        if value != "a.xbrlviewer":
+            return []
+        return [ReplayElement(self, i, link["text"]) for i, link in enumerate(self._pages["links"])]
+
+    def execute_script(self, *args):
+        return None
+
+    def quit(self):
+        pass
+
+def iter_recorded_pages():
+    chrome_dir = os.path.join(FIXTURES_DIR, "chrome")
+    if not os.path.isdir(chrome_dir):
+        return
+    for fname in sorted(os.listdir(chrome_dir)):
+        with open(os.path.join(chrome_dir, fname), "rb") as f:
+            pages = pickle.load(f)["value"]
+        for link in pages["links"]:
+            if link["page_source"]:
+                yield link["text"], link["page_source"]
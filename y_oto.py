@@ -1,22 +1,23 @@
 import sys
 import os
 import json
-import requests
 import shutil
 import math
-from datetime import datetime, timedelta, UTC
-from bs4 import BeautifulSoup
-import pandas as pd
-import openpyxl
+from datetime import datetime, timedelta
 import re
 import time
+import random
 import threading
-from io import BytesIO
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-import portalocker
-import psycopg2
+import sqlite3
+import hashlib
+from io import BytesIO, StringIO
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import replay
+import instrument
+import proxy_pool
 
 DAYS = 100
 AWS_BUCKET = "alaybey"
@@ -27,50 +28,227 @@ ENDPOINT_URL = f"https://s3.{AWS_REGION}.wasabisys.com"
 USER_AGENT = "Alper Alaybey <a.alaybey@gmail.com>"
 HEADERS = {"User-Agent": USER_AGENT}
 
-import boto3
-from botocore.client import Config
-s3 = boto3.client(
-    "s3",
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    endpoint_url=ENDPOINT_URL,
-    config=Config(signature_version="s3v4"),
-)
+S3_MAX_WORKERS = int(os.getenv("S3_MAX_WORKERS", "16"))
+S3_PART_CONCURRENCY = 4
+S3_MULTIPART_MB = 8
+
+def make_s3_client():
+    import boto3
+    from botocore.client import Config
+    if replay.replaying():
+        return replay.LocalS3(os.path.join(replay.FIXTURES_DIR, "s3"), os.path.join(replay.REPLAY_WORK_DIR, "s3"))
+    client = boto3.client(
+        "s3",
+        region_name=AWS_REGION,
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        endpoint_url=ENDPOINT_URL,
+        config=Config(
+            signature_version="s3v4",
+            max_pool_connections=S3_MAX_WORKERS * S3_PART_CONCURRENCY,
+            retries={"max_attempts": 5, "mode": "adaptive"},
+        ),
+    )
+    if replay.recording():
+        return replay.RecordingS3(client, os.path.join(replay.FIXTURES_DIR, "s3"), os.path.join(replay.REPLAY_WORK_DIR, "s3"))
+    return client
+
+# boto3 and the client are only loaded on first S3 use, so stages that never touch S3 skip both.
+S3_CLIENT = None
+S3_TRANSFER_CONFIG = None
+S3_CLIENT_LOCK = threading.Lock()
+
+def get_s3():
+    global S3_CLIENT
+    if S3_CLIENT is None:
+        with S3_CLIENT_LOCK:
+            if S3_CLIENT is None:
+                S3_CLIENT = make_s3_client()
+    return S3_CLIENT
+
+def s3_transfer_config():
+    global S3_TRANSFER_CONFIG
+    if S3_TRANSFER_CONFIG is None:
+        from boto3.s3.transfer import TransferConfig
+        S3_TRANSFER_CONFIG = TransferConfig(
+            multipart_threshold=S3_MULTIPART_MB * 1024 * 1024,
+            multipart_chunksize=S3_MULTIPART_MB * 1024 * 1024,
+            max_concurrency=S3_PART_CONCURRENCY,
+            use_threads=True,
+        )
+    return S3_TRANSFER_CONFIG
 
 def s3_path(key):
     rel_path = key.replace("\\", "/").replace("./", "")
     return rel_path.lstrip("/")
 
 def s3_exists(key):
+    instrument.inc("tarama_s3_ops_total", op="head")
     try:
-        s3.head_object(Bucket=AWS_BUCKET, Key=s3_path(key))
+        get_s3().head_object(Bucket=AWS_BUCKET, Key=s3_path(key))
         return True
     except:
         return False
 
 def s3_read_text(key):
-    obj = s3.get_object(Bucket=AWS_BUCKET, Key=s3_path(key))
+    instrument.inc("tarama_s3_ops_total", op="get")
+    obj = get_s3().get_object(Bucket=AWS_BUCKET, Key=s3_path(key))
     return obj["Body"].read().decode("utf-8")
 
 def s3_read_bytes(key):
-    obj = s3.get_object(Bucket=AWS_BUCKET, Key=s3_path(key))
+    instrument.inc("tarama_s3_ops_total", op="get")
+    obj = get_s3().get_object(Bucket=AWS_BUCKET, Key=s3_path(key))
     return obj["Body"].read()
 
 def s3_write_text(key, text):
-    s3.put_object(Bucket=AWS_BUCKET, Key=s3_path(key), Body=text.encode("utf-8"))
+    instrument.inc("tarama_s3_ops_total", op="put")
+    get_s3().put_object(Bucket=AWS_BUCKET, Key=s3_path(key), Body=text.encode("utf-8"))
 
 def s3_write_bytes(key, b):
-    s3.put_object(Bucket=AWS_BUCKET, Key=s3_path(key), Body=b)
+    instrument.inc("tarama_s3_ops_total", op="put")
+    get_s3().put_object(Bucket=AWS_BUCKET, Key=s3_path(key), Body=b)
 
 def s3_delete(key):
-    s3.delete_object(Bucket=AWS_BUCKET, Key=s3_path(key))
+    instrument.inc("tarama_s3_ops_total", op="delete")
+    get_s3().delete_object(Bucket=AWS_BUCKET, Key=s3_path(key))
 
 def s3_list_dir(prefix):
-    paginator = s3.get_paginator("list_objects_v2")
+    instrument.inc("tarama_s3_ops_total", op="list")
+    paginator = get_s3().get_paginator("list_objects_v2")
     result = paginator.paginate(Bucket=AWS_BUCKET, Prefix=s3_path(prefix))
     return [content['Key'] for page in result for content in page.get('Contents', [])]
 
+SEC_RATE = float(os.getenv("SEC_RATE", "8"))
+SEC_BUCKET = proxy_pool.TokenBucket(SEC_RATE, SEC_RATE)
+PROXY_POOL = None
+PROXY_POOL_LOCK = threading.Lock()
+YF_SESSION = None
+
+def get_proxy_pool():
+    global PROXY_POOL
+    if not proxy_pool.USE_PROXIES or replay.replaying():
+        return None
+    with PROXY_POOL_LOCK:
+        if PROXY_POOL is None:
+            PROXY_POOL = proxy_pool.ProxyPool.from_file()
+            print(f"🧭 {len(PROXY_POOL.proxies)} proxy yüklendi: {proxy_pool.PROXY_FILE}")
+        return PROXY_POOL
+
+def yahoo_session():
+    global YF_SESSION
+    if get_proxy_pool() is None:
+        return None
+    with PROXY_POOL_LOCK:
+        if YF_SESSION is None:
+            YF_SESSION = proxy_pool.make_leased_session()
+        return YF_SESSION
+
+def yahoo_call(code, fn, is_ok=None):
+    instrument.inc("tarama_http_requests_total", service="yahoo")
+    pool = get_proxy_pool()
+    if pool is None:
+        return fn()
+    return pool.call(code, fn, is_ok)
+
+def is_sec_url(url):
+    return (urlparse(url).hostname or "").endswith("sec.gov")
+
+def http_ok(resp):
+    return not proxy_pool.failed_status(resp.status_code)
+
+def proxied_get(url, proxy_key=None, **kwargs):
+    import requests
+    instrument.inc("tarama_http_requests_total", service="sec" if is_sec_url(url) else "yahoo")
+    if is_sec_url(url):
+        # SEC's fair-access limit is per organisation, not per IP, so SEC traffic stays on the
+        # direct egress under one shared budget instead of being spread over the proxy pool.
+        SEC_BUCKET.take()
+        return requests.get(url, headers=HEADERS, **kwargs)
+    pool = get_proxy_pool()
+    if pool is None:
+        return requests.get(url, headers=HEADERS, **kwargs)
+    return pool.call(proxy_key, lambda: requests.get(
+        url, headers=HEADERS, proxies=proxy_pool.current_proxy().as_requests_proxies(), **kwargs), http_ok)
+
+def http_get(url, proxy_key=None, **kwargs):
+    return replay.replay_http_get(url, lambda: proxied_get(url, proxy_key, **kwargs))
+
+def run_today():
+    return replay.frozen_today()
+
+def browser_wait(seconds):
+    if not replay.replaying():
+        time.sleep(seconds)
+
+def open_chrome_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    if replay.replaying():
+        return replay.ReplayDriver()
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--window-size=1920,1080")
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+    driver = webdriver.Chrome(options=chrome_options)
+    if replay.recording():
+        return replay.RecordingDriver(driver)
+    return driver
+
+def db_connect():
+    import psycopg2
+    # Recording only reads from live services; DB writes are captured like in replay.
+    if replay.replaying() or replay.recording():
+        return replay.ReplayConnection()
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT", "5432"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        dbname=os.getenv("DB_NAME")
+    )
+
+def s3_put_many(items, max_workers=S3_MAX_WORKERS):
+    items = list(items.items()) if isinstance(items, dict) else list(items)
+    errors = {}
+    if not items:
+        return errors
+    def put(key, b):
+        instrument.inc("tarama_s3_ops_total", op="put")
+        get_s3().upload_fileobj(BytesIO(b), AWS_BUCKET, s3_path(key), Config=s3_transfer_config())
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as ex:
+        futures = {ex.submit(put, key, b): key for key, b in items}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"📤 S3 yükleme hatası: {key} => {e}")
+                errors[key] = e
+    return errors
+
+def s3_get_many(keys, max_workers=S3_MAX_WORKERS):
+    keys = list(keys)
+    results = {}
+    if not keys:
+        return results
+    def get(key):
+        instrument.inc("tarama_s3_ops_total", op="get")
+        buf = BytesIO()
+        get_s3().download_fileobj(AWS_BUCKET, s3_path(key), buf, Config=s3_transfer_config())
+        return buf.getvalue()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as ex:
+        futures = {ex.submit(get, key): key for key in keys}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            try:
+                results[key] = fut.result()
+            except Exception as e:
+                print(f"📥 S3 indirme hatası: {key} => {e}")
+                results[key] = None
+    return results
+
 def get_trigger_ticker():
     key = "trigger.txt"
     if not s3_exists(key):
@@ -78,18 +256,69 @@ def get_trigger_ticker():
     ticker = s3_read_text(key).strip()
     if not ticker:
         raise Exception("trigger.txt içinde ticker bulunamadı!")
-    return ticker.upper(), key
+    return normalize_ticker(ticker), key
+
+TICKER_INDEX = {}
+TICKER_INDEX_LOCK = threading.Lock()
+SEC_TICKERS_URL = "https://www.sec.gov/files/company_tickers.json"
+
+def normalize_ticker(ticker):
+    return ticker.strip().upper().replace(".", "-").replace("/", "-")
+
+def load_ticker_index(tickers_file="tickers.txt"):
+    mtime = os.path.getmtime(tickers_file)
+    with TICKER_INDEX_LOCK:
+        cached = TICKER_INDEX.get(tickers_file)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+        by_ticker = {}
+        by_cik = {}
+        with open(tickers_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or ',' not in line:
+                    continue
+                t, cik = line.split(",", 1)
+                t = normalize_ticker(t)
+                cik = cik.strip().zfill(10)
+                if t in by_ticker:
+                    continue
+                by_ticker[t] = cik
+                by_cik.setdefault(cik, []).append(t)
+        TICKER_INDEX[tickers_file] = (mtime, by_ticker, by_cik)
+        return by_ticker, by_cik
 
 def get_cik_for_ticker(ticker, tickers_file="tickers.txt"):
-    with open(tickers_file, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line or ',' not in line:
-                continue
-            t, cik = line.split(",", 1)
-            if t.strip().upper() == ticker.upper():
-                return cik.strip().zfill(10)
-    raise Exception(f"{ticker} için cik bulunamadı (tickers.txt'de yok)")
+    by_ticker, _ = load_ticker_index(tickers_file)
+    cik = by_ticker.get(normalize_ticker(ticker))
+    if cik is None:
+        raise Exception(f"{ticker} için cik bulunamadı (tickers.txt'de yok)")
+    return cik
+
+def get_tickers_for_cik(cik, tickers_file="tickers.txt"):
+    _, by_cik = load_ticker_index(tickers_file)
+    return list(by_cik.get(str(cik).strip().zfill(10), []))
+
+def refresh_tickers_file_from_sec(tickers_file="tickers.txt"):
+    incr_request_and_sleep()
+    r = http_get(SEC_TICKERS_URL)
+    r.raise_for_status()
+    lines = []
+    seen = set()
+    for row in r.json().values():
+        t = normalize_ticker(str(row["ticker"]))
+        if t in seen:
+            continue
+        seen.add(t)
+        lines.append(f"{t},{str(row['cik_str']).zfill(10)}")
+    tmp_path = tickers_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, tickers_file)
+    with TICKER_INDEX_LOCK:
+        TICKER_INDEX.pop(tickers_file, None)
+    print(f"📄 {tickers_file} güncellendi: {len(lines)} ticker")
+    return len(lines)
 
 consecutive_error_count = 0
 REQUEST_COUNT = 0
@@ -99,51 +328,230 @@ def incr_request_and_sleep():
     global REQUEST_COUNT
     with REQUEST_LOCK:
         REQUEST_COUNT += 1
-        if REQUEST_COUNT % 10 == 0:
+        if REQUEST_COUNT % 10 == 0 and not replay.replaying():
             print(f"🕒 {REQUEST_COUNT} request atıldı, 2 sn bekleniyor...")
             time.sleep(0.5)
 
-def inc_error_and_kill_if_limit(limit=50):
-    global consecutive_error_count
-    consecutive_error_count += 1
-    if consecutive_error_count >= limit:
-        print("LOG: Script kill oldu! (üst üste hata limiti aşıldı)")
-        print(f"❌ ÜST ÜSTE {limit} HATA! Script kill ediliyor.")
-        sys.exit(1)
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE = float(os.getenv("RETRY_BASE", "2"))
+RETRY_CAP = float(os.getenv("RETRY_CAP", "60"))
+CIRCUIT_THRESHOLD = int(os.getenv("CIRCUIT_THRESHOLD", "5"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "120"))
+TICKER_RETRIES = int(os.getenv("TICKER_RETRIES", "3"))
+ERROR_LIMIT = 50
+ERROR_LOCK = threading.Lock()
 
-def download_file(url, s3key):
-    backoff_count = 0
-    while True:
+class TickerFailed(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpen(TickerFailed):
+    pass
+
+class CircuitBreaker:
+    # closed -> open after CIRCUIT_THRESHOLD consecutive failures; after the cooldown a single
+    # probe request is let through (half-open) and its result closes or reopens the circuit.
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_request(self):
+        with self.lock:
+            if self.opened_until == 0.0:
+                return
+            remaining = self.opened_until - time.monotonic()
+            if remaining > 0 or self.probing:
+                raise CircuitOpen(f"{self.host} devre kesici açık", retry_after=max(remaining, 1.0))
+            self.probing = True
+
+    def success(self):
+        with self.lock:
+            if self.opened_until:
+                print(f"🔌 {self.host}: devre kesici kapandı.")
+            self.failures = 0
+            self.opened_until = 0.0
+            self.probing = False
+
+    def release(self):
+        with self.lock:
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= CIRCUIT_THRESHOLD:
+                self.opened_until = time.monotonic() + CIRCUIT_COOLDOWN
+                self.probing = False
+                print(f"🔌 {self.host}: devre kesici {CIRCUIT_COOLDOWN:.0f} sn açıldı.")
+                instrument.inc("tarama_circuit_open_total", host=self.host)
+
+BREAKERS = {}
+BREAKERS_LOCK = threading.Lock()
+
+def get_breaker(url):
+    host = urlparse(url).netloc
+    with BREAKERS_LOCK:
+        if host not in BREAKERS:
+            BREAKERS[host] = CircuitBreaker(host)
+        return BREAKERS[host]
+
+def retry_delay(attempt, retry_after=None):
+    # Full jitter keeps a fleet of workers from retrying in lockstep after a shared 429.
+    delay = random.uniform(0, min(RETRY_CAP, RETRY_BASE * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def parse_retry_after(resp):
+    value = (getattr(resp, "headers", None) or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max((when - datetime.now(when.tzinfo)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def backoff_sleep(seconds):
+    if not replay.replaying():
+        time.sleep(seconds)
+
+def http_get_with_retry(url, label, **kwargs):
+    import requests
+    breaker = get_breaker(url)
+    retry_after = None
+    for attempt in range(RETRY_ATTEMPTS):
+        breaker.before_request()
         try:
             incr_request_and_sleep()
-            resp = requests.get(url, headers=HEADERS)
-            if resp.status_code in [429, 403]:
-                backoff_count += 1
-                print(f"⏳ Rate-limit algılandı! {backoff_count}. kez 2 dakika bekleniyor... [download_file] {url}")
-                if backoff_count >= 3:
-                    print("❌ 3 kez üst üste backoff, script kill ediliyor!")
-                    sys.exit(1)
-                time.sleep(120)
-                continue
-            if resp.status_code >= 400:
-                print(f"📥 Dosya indirme hatası: {url} => {resp.status_code} {resp.reason}")
-                break
-            s3_write_bytes(s3key, resp.content)
-            break
+            resp = http_get(url, **kwargs)
         except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-            backoff_count += 1
+            reason, retry_after = "connection", None
             print(f"🌐 Bağlantı hatası: {url}")
-            if backoff_count >= 3:
-                print("❌ 3 kez üst üste backoff, script kill ediliyor!")
-                sys.exit(1)
-            time.sleep(120)
-            continue
-        except Exception as e:
-            print(f"📥 Dosya indirme hatası: {url} => {e}")
-            inc_error_and_kill_if_limit()
+        except BaseException:
+            breaker.release()
+            raise
+        else:
+            if resp.status_code not in [429, 403] and resp.status_code < 500:
+                breaker.success()
+                return resp
+            reason, retry_after = str(resp.status_code), parse_retry_after(resp)
+        breaker.failure()
+        instrument.inc("tarama_http_backoff_total", reason=reason)
+        if retry_after is not None and retry_after > RETRY_CAP:
+            # Too long to wait for in a worker thread: the ticker is requeued and its slot goes to others.
+            raise TickerFailed(f"Retry-After {retry_after:.0f} sn > {RETRY_CAP:.0f} sn: {url}", retry_after=retry_after)
+        if attempt + 1 < RETRY_ATTEMPTS:
+            delay = retry_delay(attempt, retry_after)
+            print(f"⏳ Rate-limit/bağlantı hatası ({reason})! {attempt + 1}. deneme, {delay:.1f} sn bekleniyor... [{label}] {url}")
+            backoff_sleep(delay)
+    raise TickerFailed(f"{RETRY_ATTEMPTS} denemede yanıt alınamadı: {url}", retry_after=retry_delay(RETRY_ATTEMPTS, retry_after))
+
+def inc_error_count(limit=ERROR_LIMIT):
+    global consecutive_error_count
+    with ERROR_LOCK:
+        consecutive_error_count += 1
+        if consecutive_error_count < limit:
+            return
+        consecutive_error_count = 0
+    print(f"❌ ÜST ÜSTE {limit} HATA! Ticker {CIRCUIT_COOLDOWN:.0f} sn sonra yeniden denenecek.")
+    raise TickerFailed(f"üst üste {limit} hata", retry_after=CIRCUIT_COOLDOWN)
+
+def reset_error_count():
+    global consecutive_error_count
+    with ERROR_LOCK:
+        consecutive_error_count = 0
+
+def download_file(url, s3key):
+    try:
+        resp = http_get_with_retry(url, "download_file")
+        if resp.status_code >= 400:
+            print(f"📥 Dosya indirme hatası: {url} => {resp.status_code} {resp.reason}")
+            return
+        s3_write_bytes(s3key, resp.content)
+        reset_error_count()
+    except TickerFailed:
+        raise
+    except Exception as e:
+        print(f"📥 Dosya indirme hatası: {url} => {e}")
+        inc_error_count()
+
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+CPU_POOL = None
+CPU_POOL_LOCK = threading.Lock()
+# SEC HTTP and Chrome sessions share these slots; a ticker holds one only while it talks to SEC,
+# never while its tables are parsed in the CPU pool.
+SEC_CONCURRENCY = int(os.getenv("ASYNC_SEC", "2"))
+SEC_SLOTS = threading.BoundedSemaphore(SEC_CONCURRENCY)
+# A driver stays open while its tables are parsed, so live Chrome processes (~200 MB each) get their
+# own bound; by default one more per SEC slot, so parsing one filing overlaps the next one's clicks.
+CHROME_SLOTS = threading.BoundedSemaphore(int(os.getenv("ASYNC_CHROME", str(SEC_CONCURRENCY * 2))))
+
+def get_cpu_pool():
+    global CPU_POOL
+    if CPU_WORKERS <= 1:
+        return None
+    with CPU_POOL_LOCK:
+        if CPU_POOL is None:
+            # The pool is created lazily from a process that already runs asyncio/S3 threads;
+            # forking there can copy a held lock (e.g. instrument._LOCK) into the child.
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            CPU_POOL = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=ctx)
+        return CPU_POOL
+
+def cpu_task(fn, args):
+    # Runs in a pool worker; its counters and histograms travel back with the result.
+    instrument.drain()
+    try:
+        return fn(*args), None, instrument.drain()
+    except Exception as e:
+        return None, e, instrument.drain()
+
+def discard_cpu_pool(pool):
+    global CPU_POOL
+    with CPU_POOL_LOCK:
+        if CPU_POOL is pool:
+            CPU_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_cpu_pool():
+    global CPU_POOL
+    with CPU_POOL_LOCK:
+        pool, CPU_POOL = CPU_POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def run_cpu(fn, *args):
+    from concurrent.futures.process import BrokenProcessPool
+    for attempt in range(2):
+        pool = get_cpu_pool()
+        if pool is None or instrument.profiling():
+            return fn(*args)
+        try:
+            result, error, metrics = pool.submit(cpu_task, fn, args).result()
             break
+        except BrokenProcessPool:
+            # A worker died (OOM, native crash) and took the pool with it: start a fresh one and retry once.
+            print(f"⚠️ CPU havuzu bozuldu, yeniden başlatılıyor ({fn.__name__}).")
+            discard_cpu_pool(pool)
+            if attempt:
+                raise
+    instrument.merge(metrics)
+    if error is not None:
+        raise error
+    return result
 
 def clean_hidden_rows_from_html(html):
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup(html, 'lxml')
     for tr in soup.find_all('tr', style=lambda x: x and 'display:none' in x):
         tr.decompose()
@@ -174,6 +582,60 @@ def to_number(x):
     except ValueError:
         return None
 
+NOT_CONVERTED = object()
+
+class NumberRow:
+    # to_number view of one table row. A cell is converted the first time a lookup reads it and
+    # memoised, so metrics scanning the same rows share the work and untouched cells cost nothing.
+    # The lowercased cell strings and row text used for keyword matching are memoised the same way.
+    __slots__ = ("cells", "nums", "_lower", "_text")
+
+    def __init__(self, cells):
+        self.cells = cells
+        self.nums = [NOT_CONVERTED] * len(cells)
+        self._lower = None
+        self._text = None
+
+    def lower_cells(self):
+        if self._lower is None:
+            self._lower = [str(x).lower() for x in self.cells]
+        return self._lower
+
+    def text(self):
+        import pandas as pd
+        if self._text is None:
+            self._text = " ".join(low for x, low in zip(self.cells, self.lower_cells()) if pd.notna(x))
+        return self._text
+
+    def match_col(self, group):
+        for idx, cell_str in enumerate(self.lower_cells()):
+            if all(k.lower() in cell_str for k in group):
+                return idx
+        return None
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return (self[i] for i in range(*idx.indices(len(self.cells))))
+        v = self.nums[idx]
+        if v is NOT_CONVERTED:
+            v = self.nums[idx] = to_number(self.cells[idx])
+        return v
+
+    def __iter__(self):
+        return self[:]
+
+def number_rows(rows):
+    return [NumberRow(row) for row in rows]
+
+def first_number(nums):
+    for v in nums:
+        if v is not None:
+            return v
+    return None
+
 def get_sec_html_url(cik, accession):
     return f"https://www.sec.gov/cgi-bin/viewer?action=view&cik={cik}&accession_number={accession}&xbrl_type=v#"
 
@@ -207,6 +669,7 @@ def get_quarter_from_cover_page(driver, default_year, default_quarter, form_type
     return str(year), quarter
 
 def detect_period_col_from_row2(df, quarter):
+    import pandas as pd
     if df is None or df.empty or not quarter:
         return None
     try:
@@ -290,6 +753,28 @@ balance_metrics = {
     "Deferred revenue": [["defer", "revenue"], ["unearn", "revenue"]]
 }
 
+QUARTER_TOKENS = {
+    "Q1": ["3 month", "three months"],
+    "Q2": ["6 month", "six months"],
+    "Q3": ["9 month", "nine months"],
+    "Q4": ["12 month", "twelve months", "year", "annual"],
+}
+
+def quarter_token_cols(df, quarter):
+    tokens = QUARTER_TOKENS.get((quarter or "").upper(), [])
+    if not tokens:
+        return None
+    cols = []
+    for row in df.values.tolist():
+        col = None
+        for idx, cell in enumerate(row):
+            val = str(cell).lower()
+            if any(token in val for token in tokens):
+                col = idx
+                break
+        cols.append(col)
+    return cols
+
 def find_metric_in_df(
     df, kw_groups, multiplier=1.0,
     exclude_term=None, reverse=False,
@@ -297,7 +782,9 @@ def find_metric_in_df(
     tab_type=None,
     metric_name=None,
     ebit_row_idx=None,
-    html_raw=None
+    html_raw=None,
+    num_rows=None,
+    token_cols=None
 ):
     from bs4 import BeautifulSoup
 
@@ -331,130 +818,110 @@ def find_metric_in_df(
                                 return num * multiplier
         return 0.0
 
+    if num_rows is None:
+        num_rows = number_rows(df.values.tolist())
+
     if metric_name == "Noncontrolling interest":
-        rows_all = df.values.tolist()[::-1]
         for group in kw_groups:
-            for row in rows_all:
-                row_text = " ".join(str(x).lower() for x in row if pd.notna(x))
-                if exclude_term and exclude_term.lower() in row_text:
+            for nums in num_rows[::-1]:
+                if exclude_term and exclude_term.lower() in nums.text():
                     continue
-                idx_match = None
-                for idx, cell in enumerate(row):
-                    cell_str = str(cell).lower()
-                    if all(k.lower() in cell_str for k in group):
-                        idx_match = idx
-                        break
+                idx_match = nums.match_col(group)
                 if idx_match is not None:
-                    for c in row[idx_match+1:]:
-                        v = to_number(c)
-                        if v is not None:
-                            return v * multiplier
-                    for c in row:
-                        v = to_number(c)
-                        if v is not None:
-                            return v * multiplier
+                    v = first_number(nums[idx_match+1:])
+                    if v is None:
+                        v = first_number(nums)
+                    if v is not None:
+                        return v * multiplier
         return 0.0
 
     if metric_name == "Right-of-use assets":
-        rows_all = df.values.tolist()
         for group in kw_groups:
-            for row in rows_all:
-                row_text = " ".join(str(x).lower() for x in row if pd.notna(x))
-                if "lease" in row_text:
+            for nums in num_rows:
+                if "lease" in nums.text():
                     continue
-                if exclude_term and exclude_term.lower() in row_text:
+                if exclude_term and exclude_term.lower() in nums.text():
                     continue
-                idx_match = None
-                for idx, cell in enumerate(row):
-                    cell_str = str(cell).lower()
-                    if all(k.lower() in cell_str for k in group):
-                        idx_match = idx
-                        break
+                idx_match = nums.match_col(group)
                 if idx_match is not None:
-                    for c in row[idx_match+1:]:
-                        v = to_number(c)
-                        if v is not None:
-                            return v * multiplier
-                    for c in row:
-                        v = to_number(c)
-                        if v is not None:
-                            return v * multiplier
+                    v = first_number(nums[idx_match+1:])
+                    if v is None:
+                        v = first_number(nums)
+                    if v is not None:
+                        return v * multiplier
         return 0.0
 
+    if token_cols is None:
+        token_cols = quarter_token_cols(df, quarter) or []
     if metric_name in ("Interest Income", "Interest Expense") and ebit_row_idx is not None:
-        rows_all = df.values.tolist()[ebit_row_idx + 1:] if ebit_row_idx + 1 < len(df.values.tolist()) else []
-        if not rows_all:
+        nums_all = num_rows[ebit_row_idx + 1:]
+        cols_all = token_cols[ebit_row_idx + 1:]
+        if not nums_all:
             return 0.0
     else:
-        rows_all = df.values.tolist()
+        nums_all = num_rows
+        cols_all = token_cols
 
-    rows = rows_all[::-1] if reverse else rows_all
+    nrows = nums_all[::-1] if reverse else nums_all
+    tcols = cols_all[::-1] if reverse else cols_all
     if row_start is not None:
-        rows = rows[row_start:]
+        nrows = nrows[row_start:]
+        tcols = tcols[row_start:]
 
-    quarter_map = {
-        "Q1": ["3 month", "three months"],
-        "Q2": ["6 month", "six months"],
-        "Q3": ["9 month", "nine months"],
-        "Q4": ["12 month", "twelve months", "year", "annual"],
-    }
-    quarter_tokens = quarter_map.get((quarter or "").upper(), [])
     quarter_col_idx = col_override
-    if quarter_col_idx is None and quarter and quarter_tokens:
-        for row in rows:
-            for idx, cell in enumerate(row):
-                val = str(cell).lower()
-                for token in quarter_tokens:
-                    if token in val:
-                        quarter_col_idx = idx
-                        break
-                if quarter_col_idx is not None:
-                    break
-            if quarter_col_idx is not None:
-                break
+    if quarter_col_idx is None and quarter:
+        # token_cols holds, per row, the first column naming the quarter's period (see quarter_token_cols).
+        quarter_col_idx = next((c for c in tcols if c is not None), None)
 
     for group in kw_groups:
-        for row in rows:
-            row_text = " ".join(str(x).lower() for x in row if pd.notna(x))
-            if exclude_term and exclude_term.lower() in row_text:
+        for nums in nrows:
+            if exclude_term and exclude_term.lower() in nums.text():
                 continue
-            idx_match = None
-            for idx, cell in enumerate(row):
-                cell_str = str(cell).lower()
-                if all(k.lower() in cell_str for k in group):
-                    idx_match = idx
-                    break
+            idx_match = nums.match_col(group)
             if idx_match is not None:
+                row = nums.cells
                 if tab_type == "income_statement":
                     q = (quarter or "").upper()
                     if q in ["Q2", "Q3"] and len(row) > idx_match + 3:
-                        v = to_number(row[idx_match + 3])
+                        v = nums[idx_match + 3]
                         if v is not None:
                             return v * multiplier
                     elif len(row) > idx_match + 1:
-                        v = to_number(row[idx_match + 1])
+                        v = nums[idx_match + 1]
                         if v is not None:
                             return v * multiplier
                 if quarter_col_idx is not None and len(row) > quarter_col_idx:
-                    v = to_number(row[quarter_col_idx])
-                    if v is not None:
-                        return v * multiplier
-                for c in row[idx_match+1:]:
-                    v = to_number(c)
-                    if v is not None:
-                        return v * multiplier
-                for c in row:
-                    v = to_number(c)
+                    v = nums[quarter_col_idx]
                     if v is not None:
                         return v * multiplier
+                v = first_number(nums[idx_match+1:])
+                if v is None:
+                    v = first_number(nums)
+                if v is not None:
+                    return v * multiplier
+    return None
+
+# (statement type, substrings that must all appear, substrings that must not), checked in order.
+STATEMENT_LINK_RULES = [
+    ("balance_sheet", ("balance sheet",), ("parenthetical",)),
+    ("cash_flow", ("cash flow",), ()),
+    ("income_statement", ("income", "statement"), ()),
+    ("income_statement", ("statements of operations",), ()),
+]
+STATEMENT_LOG_NAMES = {"balance_sheet": "BALANCE", "cash_flow": "CASH FLOW", "income_statement": "INCOME"}
+
+def classify_statement_link(link_text):
+    t = link_text.lower()
+    for tab_type, required, excluded in STATEMENT_LINK_RULES:
+        if all(k in t for k in required) and not any(k in t for k in excluded):
+            return tab_type
     return None
 
 def extract_tabular_data_from_html(driver):
-    import time
     from selenium.webdriver.common.by import By
     print("="*60)
     print("extract_tabular_data_from_html ÇAĞRILDI")
-    time.sleep(2)
+    browser_wait(2)
     found_tables = []
     fs_menu = None
     try:
@@ -480,11 +947,11 @@ def extract_tabular_data_from_html(driver):
                 try:
                     fs_menu.click()
                     print("[LOG] Menüye tıklandı.")
-                    time.sleep(2)
+                    browser_wait(2)
                     break
                 except Exception as e:
                     print("[LOG] Menüye tıklanamadı, tekrar deneniyor:", e)
-                    time.sleep(2)
+                    browser_wait(2)
         except Exception as e:
             print("[LOG] Menü scroll/tıkla hatası:", e)
     else:
@@ -500,152 +967,241 @@ def extract_tabular_data_from_html(driver):
     if not links:
         links = driver.find_elements(By.CSS_SELECTOR, 'a.xbrlviewer')
         print(f"[LOG] Yedek planda {len(links)} adet tablo linki bulundu.")
-    print("\nTABLO LİSTESİ:")
-    for link in links:
-        print(" >", (link.text or link.get_attribute("innerText") or "").strip())
     print("\nBAŞLIK EŞLEŞME LOGU:")
     for link in links:
         link_text = (link.text or link.get_attribute("innerText") or "").strip()
-        t = link_text.lower()
-        matched = False
-        if "balance sheet" in t and "parenthetical" not in t:
-            print(f"BALANCE eşleşti  ---> {t}")
-            found_tables.append(("balance_sheet", link_text, link))
-            matched = True
-        elif "cash flow" in t:
-            print(f"CASH FLOW eşleşti  ---> {t}")
-            found_tables.append(("cash_flow", link_text, link))
-            matched = True
-        elif ("income" in t and "statement" in t) or "statements of operations" in t:
-            print(f"INCOME eşleşti  ---> {t}")
-            found_tables.append(("income_statement", link_text, link))
-            matched = True
-        if not matched:
-            print(f"EŞLEŞME YOK    ---> {t}")
+        tab_type = classify_statement_link(link_text)
+        if tab_type is None:
+            print(f"EŞLEŞME YOK    ---> {link_text.lower()}")
+            continue
+        print(f"{STATEMENT_LOG_NAMES[tab_type]} eşleşti  ---> {link_text.lower()}")
+        found_tables.append((tab_type, link_text, link))
     print("\n[LOG] found_tables:", [(a, b) for a, b, c in found_tables])
     print("="*60)
     return found_tables
 
-def extract_metrics_from_sec_html(driver, found_tables, year, quarter):
+LAYOUT_DIR = "Layouts"
+
+def describe_statement_table(tab_type, df, quarter):
+    # Layout of one statement table, detected once and shared by every metric lookup:
+    # period column, unit multipliers, EBIT row and the per-row quarter-token columns.
+    import pandas as pd
+    try:
+        row2 = " ".join([str(x).lower() for x in df.iloc[1] if pd.notna(x)])
+    except Exception:
+        row2 = ""
+    if "$ in millions" in row2:
+        multiplier = 1_000_000.0
+    elif "$ in thousands" in row2:
+        multiplier = 1_000.0
+    else:
+        multiplier = 1.0
+    shares_multiplier = 1.0
+    ebit_row = None
+    if tab_type == "income_statement":
+        if "shares in millions" in row2:
+            shares_multiplier = 1_000_000.0
+        elif "shares in thousands" in row2:
+            shares_multiplier = 1_000.0
+        rows = df.values.tolist()
+        for group in income_metrics["EBIT"]:
+            for row_idx, row in enumerate(rows):
+                if any(all(k.lower() in str(cell).lower() for k in group) for cell in row):
+                    ebit_row = row_idx
+                    break
+            if ebit_row is not None:
+                break
+    return {
+        "tab_type": tab_type,
+        "quarter": quarter,
+        "shape": list(df.shape),
+        "period_col": detect_period_col_from_row2(df, quarter),
+        "multiplier": multiplier,
+        "shares_multiplier": shares_multiplier,
+        "ebit_row": ebit_row,
+        "quarter_cols": quarter_token_cols(df, quarter) or [],
+    }
+
+def layout_key(tab_type, link_text, quarter):
+    return f"{tab_type}|{quarter}|{link_text}"
+
+def layout_cache_path(accession):
+    return os.path.join(LAYOUT_DIR, f"{accession}.json")
+
+def load_layouts(accession):
+    path = layout_cache_path(accession) if accession else None
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_layouts(accession, layouts):
+    if not accession or not layouts:
+        return
+    os.makedirs(LAYOUT_DIR, exist_ok=True)
+    path = layout_cache_path(accession)
+    merged = {**load_layouts(accession), **layouts}
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(merged, f)
+    os.replace(path + ".tmp", path)
+
+def extract_metrics_from_table_html(tab_type, link_text, html, quarter, extracted, layout=None):
+    import pandas as pd
+    processed = False
+    with instrument.span("read_html", table=tab_type):
+        clean_html = clean_hidden_rows_from_html(html)
+        dfs = pd.read_html(StringIO(clean_html))
+    if not dfs:
+        return False, None
+    df = dfs[0]
+    num_rows = number_rows(df.values.tolist())
+    if layout is None or layout.get("shape") != list(df.shape):
+        layout = describe_statement_table(tab_type, df, quarter)
+    else:
+        instrument.inc("tarama_layout_cache_hits_total")
+    forced_col_idx = layout["period_col"]
+    multiplier = layout["multiplier"]
+    shares_out_multiplier = layout["shares_multiplier"]
+    ebit_row_idx = layout["ebit_row"]
+    token_cols = layout["quarter_cols"]
+    if tab_type == "cash_flow":
+        for metric, kw_groups in cash_flow_metrics.items():
+            val = find_metric_in_df(
+                df, kw_groups, multiplier=multiplier,
+                quarter=quarter, col_override=forced_col_idx,
+                tab_type=tab_type,
+                metric_name=metric,
+                html_raw=clean_html,
+                num_rows=num_rows,
+                token_cols=token_cols
+            )
+            extracted[metric] = val if val is not None else 0.0
+        processed = True
+    elif tab_type == "income_statement":
+        for metric, kw_groups in income_metrics.items():
+            if metric == "EPS":
+                val = find_metric_in_df(
+                    df, kw_groups, multiplier=1.0,
+                    quarter=quarter, col_override=forced_col_idx,
+                    tab_type=tab_type,
+                    metric_name=metric,
+                    html_raw=clean_html,
+                    num_rows=num_rows,
+                    token_cols=token_cols
+                )
+                extracted[metric] = val if val is not None else 0.0
+            elif metric == "Shares Outstanding":
+                val = find_metric_in_df(
+                    df, kw_groups, multiplier=shares_out_multiplier, reverse=True,
+                    quarter=quarter, col_override=forced_col_idx,
+                    tab_type=tab_type,
+                    metric_name=metric,
+                    html_raw=clean_html,
+                    num_rows=num_rows,
+                    token_cols=token_cols
+                )
+                extracted[metric] = val if val is not None else 0.0
+            elif metric in ("Interest Income", "Interest Expense"):
+                val = find_metric_in_df(
+                    df, kw_groups, multiplier=multiplier,
+                    quarter=quarter, col_override=forced_col_idx,
+                    tab_type=tab_type,
+                    metric_name=metric,
+                    ebit_row_idx=ebit_row_idx,
+                    html_raw=clean_html,
+                    num_rows=num_rows,
+                    token_cols=token_cols
+                )
+                extracted[metric] = val if val is not None else 0.0
+            else:
+                val = find_metric_in_df(
+                    df, kw_groups, multiplier=multiplier,
+                    quarter=quarter, col_override=forced_col_idx,
+                    tab_type=tab_type,
+                    metric_name=metric,
+                    html_raw=clean_html,
+                    num_rows=num_rows,
+                    token_cols=token_cols
+                )
+                extracted[metric] = val if val is not None else 0.0
+        processed = True
+    elif tab_type == "balance_sheet":
+        for metric, kw_groups in balance_metrics.items():
+            val = find_metric_in_df(
+                df, kw_groups, multiplier=multiplier,
+                quarter=quarter, col_override=forced_col_idx,
+                tab_type=tab_type,
+                metric_name=metric,
+                html_raw=clean_html,
+                num_rows=num_rows,
+                token_cols=token_cols
+            )
+            extracted[metric] = val if val is not None else 0.0
+        processed = True
+    return processed, layout
+
+def collect_statement_html(driver, tables):
+    pages = []
+    for tab_type, link_text, link in tables:
+        try:
+            link.click()
+            browser_wait(2)
+            pages.append((tab_type, link_text, driver.page_source))
+        except Exception as e:
+            print("[ERROR] collect_statement_html:", str(e))
+    return pages
+
+def extract_metrics_from_pages(pages, quarter, layouts=None):
+    layouts = layouts or {}
     extracted = {}
-    processed_types = set()
-    dfs_in_ram = []
-    for tab_type, link_text, link in found_tables:
+    processed_types = []
+    new_layouts = {}
+    for tab_type, link_text, html in pages:
         if tab_type in processed_types:
             continue
+        key = layout_key(tab_type, link_text, quarter)
         try:
-            link.click()
-            import time
-            time.sleep(2)
-            html = driver.page_source
-            clean_html = clean_hidden_rows_from_html(html)
-            dfs = pd.read_html(clean_html)
-            if not dfs:
-                continue
-            df = dfs[0]
-            forced_col_idx = detect_period_col_from_row2(df, quarter)
-            title = link_text.lower()
-            try:
-                row2 = " ".join([str(x).lower() for x in df.iloc[1] if pd.notna(x)])
-            except Exception:
-                row2 = ""
-            if "$ in millions" in row2:
-                multiplier = 1_000_000.0
-            elif "$ in thousands" in row2:
-                multiplier = 1_000.0
-            else:
-                multiplier = 1.0
-            shares_out_multiplier = 1.0
-            if tab_type == "income_statement":
-                if "shares in millions" in row2:
-                    shares_out_multiplier = 1_000_000.0
-                elif "shares in thousands" in row2:
-                    shares_out_multiplier = 1_000.0
-                else:
-                    shares_out_multiplier = 1.0
-            if tab_type == "cash_flow":
-                for metric, kw_groups in cash_flow_metrics.items():
-                    val = find_metric_in_df(
-                        df, kw_groups, multiplier=multiplier,
-                        quarter=quarter, col_override=forced_col_idx,
-                        tab_type=tab_type,
-                        metric_name=metric,
-                        html_raw=clean_html
-                    )
-                    extracted[metric] = val if val is not None else 0.0
-                processed_types.add("cash_flow")
-            elif tab_type == "income_statement":
-                ebit_row_idx = None
-                rows = df.values.tolist()
-                for i, group in enumerate(income_metrics["EBIT"]):
-                    for row_idx, row in enumerate(rows):
-                        for cell in row:
-                            cell_str = str(cell).lower()
-                            if all(k.lower() in cell_str for k in group):
-                                ebit_row_idx = row_idx
-                                break
-                        if ebit_row_idx is not None:
-                            break
-                    if ebit_row_idx is not None:
-                        break
-                for metric, kw_groups in income_metrics.items():
-                    if metric == "EPS":
-                        val = find_metric_in_df(
-                            df, kw_groups, multiplier=1.0,
-                            quarter=quarter, col_override=forced_col_idx,
-                            tab_type=tab_type,
-                            metric_name=metric,
-                            html_raw=clean_html
-                        )
-                        extracted[metric] = val if val is not None else 0.0
-                    elif metric == "Shares Outstanding":
-                        val = find_metric_in_df(
-                            df, kw_groups, multiplier=shares_out_multiplier, reverse=True,
-                            quarter=quarter, col_override=forced_col_idx,
-                            tab_type=tab_type,
-                            metric_name=metric,
-                            html_raw=clean_html
-                        )
-                        extracted[metric] = val if val is not None else 0.0
-                    elif metric in ("Interest Income", "Interest Expense"):
-                        val = find_metric_in_df(
-                            df, kw_groups, multiplier=multiplier,
-                            quarter=quarter, col_override=forced_col_idx,
-                            tab_type=tab_type,
-                            metric_name=metric,
-                            ebit_row_idx=ebit_row_idx,
-                            html_raw=clean_html
-                        )
-                        extracted[metric] = val if val is not None else 0.0
-                    else:
-                        val = find_metric_in_df(
-                            df, kw_groups, multiplier=multiplier,
-                            quarter=quarter, col_override=forced_col_idx,
-                            tab_type=tab_type,
-                            metric_name=metric,
-                            html_raw=clean_html
-                        )
-                        extracted[metric] = val if val is not None else 0.0
-                processed_types.add("income_statement")
-            elif tab_type == "balance_sheet":
-                for metric, kw_groups in balance_metrics.items():
-                    val = find_metric_in_df(
-                        df, kw_groups, multiplier=multiplier,
-                        quarter=quarter, col_override=forced_col_idx,
-                        tab_type=tab_type,
-                        metric_name=metric,
-                        html_raw=clean_html
-                    )
-                    extracted[metric] = val if val is not None else 0.0
-                processed_types.add("balance_sheet")
-            del df
-            del dfs
+            processed, layout = extract_metrics_from_table_html(tab_type, link_text, html, quarter, extracted, layouts.get(key))
+            if layout is not None and key not in layouts:
+                new_layouts[key] = layout
+            if processed:
+                processed_types.append(tab_type)
         except Exception as e:
             print("[ERROR] extract_metrics_from_sec_html:", str(e))
             continue
-    for df in dfs_in_ram:
-        del df
-    return extracted
+    return extracted, processed_types, new_layouts
+
+def extract_metrics_from_sec_html(driver, found_tables, year, quarter, accession=None):
+    # Browser clicks stay in this process under an SEC slot; parsing and matching run in the CPU pool
+    # after the slot is released, so other tickers can use Chrome meanwhile.
+    # One candidate per statement type is fetched per round, and the next candidate
+    # of a type is only clicked if the previous one produced nothing.
+    extracted = {}
+    processed_types = set()
+    layouts = load_layouts(accession)
+    new_layouts = {}
+    remaining = list(found_tables)
+    while remaining:
+        batch, rest, seen = [], [], set()
+        for table in remaining:
+            if table[0] in processed_types:
+                continue
+            if table[0] in seen:
+                rest.append(table)
+            else:
+                seen.add(table[0])
+                batch.append(table)
+        if not batch:
+            break
+        with SEC_SLOTS:
+            pages = collect_statement_html(driver, batch)
+        metrics, processed, found_layouts = run_cpu(extract_metrics_from_pages, pages, quarter, layouts)
+        new_layouts.update(found_layouts)
+        extracted.update(metrics)
+        processed_types.update(processed)
+        remaining = rest
+    save_layouts(accession, new_layouts)
+    return extracted, processed_types
 
 def sort_quarter_columns(cols):
     def quarter_key(col):
@@ -664,76 +1220,344 @@ def sort_quarter_columns(cols):
     else:
         return sorted(cols, key=quarter_key)
 
-def save_to_final_excel(symbol, year, quarter, extracted):
-    import os
-    os.makedirs("Final", exist_ok=True)
-    out_path = os.path.join("Final", f"{symbol}.xlsx")
-    all_metrics = list(cash_flow_metrics.keys()) + list(income_metrics.keys()) + list(balance_metrics.keys())
-    col_name = f"{year} {quarter}"
-    col_values = [extracted.get(m, 0.0) for m in all_metrics]
-    if os.path.exists(out_path):
-        try:
-            df_existing = pd.read_excel(out_path)
-            if "Metric" not in df_existing.columns:
-                df_existing.insert(0, "Metric", all_metrics)
-            df = df_existing.set_index("Metric")
-        except Exception:
-            df = pd.DataFrame(index=all_metrics)
+METRICS_DIR = "Metrics"
+# The store is the source of truth and Final2 reads it directly; Final/<ticker>.xlsx is only
+# written when asked for (here, or with --export-final).
+FINAL_XLSX_EXPORT = os.getenv("FINAL_XLSX_EXPORT", "0") == "1"
+
+def all_metric_names():
+    return list(cash_flow_metrics.keys()) + list(income_metrics.keys()) + list(balance_metrics.keys())
+
+def metrics_store_path(symbol, period=None):
+    ticker_dir = os.path.join(METRICS_DIR, f"ticker={symbol}")
+    if period is None:
+        return ticker_dir
+    return os.path.join(ticker_dir, f"{period.replace(' ', '_')}.parquet")
+
+def metrics_store_digest(symbol):
+    h = hashlib.sha256()
+    ticker_dir = metrics_store_path(symbol)
+    if os.path.isdir(ticker_dir):
+        for name in sorted(os.listdir(ticker_dir)):
+            if name.startswith(".") or not name.endswith(".parquet"):
+                continue
+            h.update(name.encode("utf-8"))
+            with open(os.path.join(ticker_dir, name), "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+def write_period_to_store(symbol, period, values):
+    import pandas as pd
+    out_path = metrics_store_path(symbol, period)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    df = pd.DataFrame({
+        "metric": list(values.keys()),
+        "period": period,
+        "value": pd.Series([None if v is None else float(v) for v in values.values()], dtype="float64"),
+    })
+    # Dot-prefixed so dataset readers skip a half-written file left in the directory.
+    tmp_path = os.path.join(os.path.dirname(out_path), "." + os.path.basename(out_path) + ".tmp")
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, out_path)
+
+def read_metrics_store(symbol=None, metrics=None, periods=None):
+    import pandas as pd
+    path = METRICS_DIR if symbol is None else metrics_store_path(symbol)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=["ticker", "metric", "period", "value"])
+    filters = []
+    if metrics is not None:
+        filters.append(("metric", "in", list(metrics)))
+    if periods is not None:
+        filters.append(("period", "in", list(periods)))
+    df = pd.read_parquet(path, filters=filters or None)
+    if symbol is not None:
+        df["ticker"] = symbol
     else:
-        df = pd.DataFrame(index=all_metrics)
-    df[col_name] = col_values
-    df_reset = df.reset_index()
-    cols = df_reset.columns.tolist()
-    sorted_cols = sort_quarter_columns(cols)
-    df_sorted = df_reset[sorted_cols]
-    df_sorted.to_excel(out_path, index=False)
+        df["ticker"] = df["ticker"].astype(str)
+    return df[["ticker", "metric", "period", "value"]]
+
+def import_final_excel_to_store(symbol, path):
+    import pandas as pd
     try:
-        wb_out = openpyxl.load_workbook(out_path)
-        ws = wb_out.active
-        for row in ws.iter_rows(min_row=2, min_col=2):
-            for cell in row:
-                if cell.value is None:
-                    cell.value = ""
-        wb_out.save(out_path)
+        df = pd.read_excel(path)
     except Exception:
-        pass
+        return
+    if "Metric" not in df.columns:
+        df.insert(0, "Metric", all_metric_names()[:len(df)])
+    for col in df.columns:
+        if col == "Metric" or not re.match(r"\d{4}\s+Q[1-4]$", str(col)):
+            continue
+        values = {m: to_number(v) for m, v in zip(df["Metric"], df[col])}
+        write_period_to_store(symbol, str(col), values)
+
+def final_rows(symbol):
+    df = read_metrics_store(symbol)
+    all_metrics = all_metric_names()
+    wide = df.pivot_table(index="metric", columns="period", values="value", aggfunc="last", dropna=False)
+    extra = [m for m in wide.index if m not in all_metrics]
+    wide = wide.reindex(all_metrics + extra)
+    cols = sort_quarter_columns(["Metric"] + [str(c) for c in wide.columns])
+    wide.columns = [str(c) for c in wide.columns]
+    wide = wide[cols[1:]]
+    rows = [cols]
+    for metric, values in zip(wide.index, wide.to_numpy(dtype=float).tolist()):
+        rows.append([metric] + [None if v != v else v for v in values])
+    return rows
+
+def final_values_from_store(symbol, max_row=36, max_col=59):
+    # The A1:BG36 block of Final/<symbol>.xlsx, without writing or parsing the workbook.
+    from openpyxl.utils import get_column_letter
+    values = {}
+    for r, row in enumerate(final_rows(symbol)[:max_row], 1):
+        for c, value in enumerate(row[:max_col], 1):
+            if value is not None:
+                values[f"{get_column_letter(c)}{r}"] = value
+    return values
+
+def export_final_excel(symbol, out_path=None):
+    import openpyxl
+    if out_path is None:
+        os.makedirs("Final", exist_ok=True)
+        out_path = os.path.join("Final", f"{symbol}.xlsx")
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet")
+    for row in final_rows(symbol):
+        ws.append(["" if v is None else v for v in row])
+    wb.save(out_path)
+    return out_path
+
+def save_to_final_excel(symbol, year, quarter, extracted):
+    legacy_path = os.path.join("Final", f"{symbol}.xlsx")
+    if not os.path.isdir(metrics_store_path(symbol)) and os.path.exists(legacy_path):
+        import_final_excel_to_store(symbol, legacy_path)
+    period = f"{year} {quarter}"
+    write_period_to_store(symbol, period, {m: extracted.get(m, 0.0) for m in all_metric_names()})
+    if FINAL_XLSX_EXPORT:
+        export_final_excel(symbol)
+
+MATRIX_DIR = "Matrix"
+FLOW_METRICS = set(cash_flow_metrics) | set(income_metrics)
+
+def period_sort_key(period):
+    m = re.match(r"(\d{4})\s+Q([1-4])", str(period))
+    if not m:
+        return (0, 0)
+    return (int(m.group(1)), int(m.group(2)))
+
+def build_metrics_matrix(out_dir=MATRIX_DIR):
+    import numpy as np
+    df = read_metrics_store()
+    metrics = all_metric_names()
+    df = df[df["metric"].isin(metrics)]
+    tickers = sorted(df["ticker"].unique())
+    periods = sorted(df["period"].unique(), key=period_sort_key)
+    os.makedirs(out_dir, exist_ok=True)
+    tmp_path = os.path.join(out_dir, "values.npy.tmp")
+    values = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                       shape=(len(tickers), len(metrics), len(periods)))
+    values[:] = np.nan
+    if len(df):
+        t_idx = df["ticker"].map({t: i for i, t in enumerate(tickers)}).to_numpy()
+        m_idx = df["metric"].map({m: i for i, m in enumerate(metrics)}).to_numpy()
+        p_idx = df["period"].map({p: i for i, p in enumerate(periods)}).to_numpy()
+        values[t_idx, m_idx, p_idx] = df["value"].to_numpy(dtype=np.float32)
+    values.flush()
+    del values
+    # Both files are swapped in whole, index first; load_metrics_matrix rereads if it catches the pair mid-swap.
+    index_tmp = os.path.join(out_dir, "index.json.tmp")
+    with open(index_tmp, "w", encoding="utf-8") as f:
+        json.dump({"tickers": tickers, "metrics": metrics, "periods": periods}, f)
+    os.replace(index_tmp, os.path.join(out_dir, "index.json"))
+    os.replace(tmp_path, os.path.join(out_dir, "values.npy"))
+    return out_dir
+
+def load_metrics_matrix(path=MATRIX_DIR):
+    import numpy as np
+    for attempt in range(3):
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+        if values.shape == (len(index["tickers"]), len(index["metrics"]), len(index["periods"])):
+            break
+        time.sleep(0.1)
+    else:
+        raise Exception(f"{path}: index.json ile values.npy uyuşmuyor")
+    return {
+        "values": values,
+        "ticker_list": index["tickers"],
+        "period_list": index["periods"],
+        "tickers": {t: i for i, t in enumerate(index["tickers"])},
+        "metrics": {m: i for i, m in enumerate(index["metrics"])},
+        "periods": {p: i for i, p in enumerate(index["periods"])},
+    }
+
+def _latest_period_idx(a):
+    import numpy as np
+    valid = ~np.isnan(a)
+    last = a.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+    return np.where(valid.any(axis=1), last, -1)
+
+def matrix_series(mx, ticker, metric):
+    import numpy as np
+    import pandas as pd
+    row = mx["values"][mx["tickers"][ticker], mx["metrics"][metric], :]
+    return pd.Series(np.asarray(row, dtype=np.float64), index=mx["period_list"]).dropna()
+
+def matrix_period(mx, metric, period):
+    import numpy as np
+    import pandas as pd
+    col = mx["values"][:, mx["metrics"][metric], mx["periods"][period]]
+    return pd.Series(np.asarray(col, dtype=np.float64), index=mx["ticker_list"])
+
+def matrix_latest(mx, metric):
+    import numpy as np
+    import pandas as pd
+    a = np.asarray(mx["values"][:, mx["metrics"][metric], :], dtype=np.float64)
+    last = _latest_period_idx(a)
+    out = np.where(last >= 0, a[np.arange(a.shape[0]), np.maximum(last, 0)], np.nan)
+    return pd.Series(out, index=mx["ticker_list"])
+
+def matrix_ttm(mx, metric):
+    # Income and cash flow values are fiscal year-to-date (Q2 = 6 months, Q4 = 12 months),
+    # so TTM = latest YTD + previous FY - previous year's same YTD. Balance sheet items use the latest value.
+    import numpy as np
+    import pandas as pd
+    if metric not in FLOW_METRICS:
+        return matrix_latest(mx, metric)
+    a = np.asarray(mx["values"][:, mx["metrics"][metric], :], dtype=np.float64)
+    keys = [period_sort_key(p) for p in mx["period_list"]]
+    pos = {k: i for i, k in enumerate(keys)}
+    last = _latest_period_idx(a)
+    out = np.full(a.shape[0], np.nan)
+    for t, p in enumerate(last):
+        if p < 0:
+            continue
+        year, q = keys[p]
+        if q == 4:
+            out[t] = a[t, p]
+            continue
+        prev_fy = pos.get((year - 1, 4))
+        prev_ytd = pos.get((year - 1, q))
+        if prev_fy is not None and prev_ytd is not None:
+            out[t] = a[t, p] + a[t, prev_fy] - a[t, prev_ytd]
+    return pd.Series(out, index=mx["ticker_list"])
+
+JOURNAL_PATH = os.getenv("RUN_JOURNAL", "run_journal.sqlite")
+JOURNAL_CONN = None
+JOURNAL_LOCK = threading.Lock()
+
+def journal_conn():
+    global JOURNAL_CONN
+    if JOURNAL_CONN is None:
+        JOURNAL_CONN = sqlite3.connect(JOURNAL_PATH, check_same_thread=False)
+        JOURNAL_CONN.execute("""
+            CREATE TABLE IF NOT EXISTS stages (
+                ticker TEXT, stage TEXT, input_hash TEXT, output TEXT, completed_at TEXT,
+                PRIMARY KEY (ticker, stage)
+            )
+        """)
+        JOURNAL_CONN.commit()
+    return JOURNAL_CONN
+
+def journal_hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+def journal_output(ticker, stage, input_hash):
+    if not JOURNAL_PATH:
+        return False, None
+    with JOURNAL_LOCK:
+        row = journal_conn().execute(
+            "SELECT output FROM stages WHERE ticker=? AND stage=? AND input_hash=?",
+            (ticker, stage, input_hash)).fetchone()
+    if row is None:
+        return False, None
+    print(f"⏭️ {ticker}: {stage} aşaması journal'dan atlandı.")
+    instrument.inc("tarama_journal_skips_total", stage=stage)
+    return True, json.loads(row[0]) if row[0] is not None else None
+
+def journal_done(ticker, stage, input_hash):
+    return journal_output(ticker, stage, input_hash)[0]
+
+def journal_mark(ticker, stage, input_hash, output=None):
+    if not JOURNAL_PATH:
+        return
+    with JOURNAL_LOCK:
+        conn = journal_conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO stages (ticker, stage, input_hash, output, completed_at) VALUES (?, ?, ?, ?, ?)",
+            (ticker, stage, input_hash, json.dumps(output, default=float) if output is not None else None,
+             datetime.now().isoformat(timespec="seconds")))
+        conn.commit()
 
 def main():
     ticker, trigger_key = get_trigger_ticker()
-    cik = get_cik_for_ticker(ticker)
-    days = DAYS
+    try:
+        with instrument.span("run", ticker=ticker):
+            process_ticker(ticker)
+    except TickerFailed as e:
+        # The journal keeps finished stages, so the next trigger for this ticker resumes from here.
+        print(f"❌ {ticker}: {e}")
+        instrument.log_event("ticker_failed", ticker=ticker, error=str(e), retry_after=e.retry_after)
+
+def fetch_submissions(ticker, cik):
     url = f"https://data.sec.gov/submissions/CIK{cik}.json"
-    backoff_count = 0
-    while True:
+    try:
+        with SEC_SLOTS, instrument.span("sec_submissions", ticker=ticker):
+            r = http_get_with_retry(url, "main")
+        if r.status_code >= 400:
+            print(f"⚠️ {ticker}: {cik} - API hatası veya veri yok. {r.status_code} {r.reason}")
+            inc_error_count()
+            return None
+        data = r.json().get("filings", {}).get("recent", {})
+        reset_error_count()
+        return data
+    except TickerFailed:
+        raise
+    except Exception as e:
+        print(f"⚠️ {ticker}: {cik} - Veri çekilemedi: {e}")
+        inc_error_count()
+        return None
+
+def extract_filing(ticker, cik, acc, year, quarter, ftype):
+    html_url = get_sec_html_url(cik, acc)
+    driver = None
+    # Taken before SEC_SLOTS and held until quit(), always in that order.
+    with CHROME_SLOTS:
         try:
-            incr_request_and_sleep()
-            r = requests.get(url, headers=HEADERS)
-            if r.status_code in [429, 403]:
-                backoff_count += 1
-                print(f"⏳ Rate-limit algılandı! {backoff_count}. kez 2 dakika bekleniyor... [main] {url}")
-                if backoff_count >= 3:
-                    print("❌ 3 kez üst üste backoff, script kill ediliyor!")
-                    sys.exit(1)
-                time.sleep(120)
-                continue
-            if r.status_code >= 400:
-                print(f"⚠️ {ticker}: {cik} - API hatası veya veri yok. {r.status_code} {r.reason}")
-                inc_error_and_kill_if_limit()
-                return
-            data = r.json().get("filings", {}).get("recent", {})
-            break
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-            backoff_count += 1
-            print(f"🌐 Bağlantı hatası: {url}")
-            if backoff_count >= 3:
-                print("❌ 3 kez üst üste backoff, script kill ediliyor!")
-                sys.exit(1)
-            time.sleep(120)
-            continue
-        except Exception as e:
-            print(f"⚠️ {ticker}: {cik} - Veri çekilemedi: {e}")
-            inc_error_and_kill_if_limit()
+            with SEC_SLOTS:
+                with instrument.span("chrome_open", ticker=ticker):
+                    driver = open_chrome_driver()
+                    driver.get(html_url)
+                    browser_wait(2)
+                    year, quarter = get_quarter_from_cover_page(driver, year, quarter, ftype)
+                with instrument.span("find_tables", ticker=ticker):
+                    found_tables = extract_tabular_data_from_html(driver)
+            if not found_tables:
+                return None
+            with instrument.span("extract_metrics", ticker=ticker, period=f"{year} {quarter}"):
+                extracted, processed = extract_metrics_from_sec_html(driver, found_tables, year, quarter, acc)
+            return {"year": year, "quarter": quarter, "extracted": extracted, "processed": sorted(processed)}
+        finally:
+            if driver is not None:
+                driver.quit()
+
+def process_ticker(ticker):
+    cik = get_cik_for_ticker(ticker)
+    days = DAYS
+    fetch_hash = journal_hash(cik, run_today())
+    fetched, data = journal_output(ticker, "fetched", fetch_hash)
+    if not fetched:
+        data = fetch_submissions(ticker, cik)
+        if data is None:
             return
+        data = {k: data.get(k, []) for k in ("form", "accessionNumber", "reportDate")}
+        journal_mark(ticker, "fetched", fetch_hash, data)
     forms = data.get("form", [])
     accessions = data.get("accessionNumber", [])
     report_dates = data.get("reportDate", [])
@@ -745,36 +1569,70 @@ def main():
             rpt_date = datetime.strptime(report_dates[i], "%Y-%m-%d")
         except:
             continue
-        filter_date = (datetime.now(UTC) - timedelta(days=days)).date()
+        filter_date = run_today() - timedelta(days=days)
         if rpt_date.date() < filter_date:
             continue
         acc = accessions[i].replace("-", "")
         year, quarter = get_quarter_from_date(rpt_date, ftype)
-        html_url = get_sec_html_url(cik, acc)
-        chrome_options = Options()
-        chrome_options.add_argument("--headless=new")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument(f"user-agent={USER_AGENT}")
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.get(html_url)
-        time.sleep(2)
-        year, quarter = get_quarter_from_cover_page(driver, year, quarter, ftype)
-        found_tables = extract_tabular_data_from_html(driver)
-        if found_tables:
-            extracted = extract_metrics_from_sec_html(driver, found_tables, year, quarter)
-            save_to_final_excel(ticker, year, quarter, extracted)
-            found = True
-        driver.quit()
-        if found:
-            break
+        extract_hash = journal_hash(acc, ftype)
+        done, result = journal_output(ticker, "extracted", extract_hash)
+        if not done:
+            result = extract_filing(ticker, cik, acc, year, quarter, ftype)
+            if result is None:
+                continue
+            # A filing where no statement could be read is not journaled, so the next run tries it again.
+            if result["processed"]:
+                journal_mark(ticker, "extracted", extract_hash, result)
+        final_hash = journal_hash(result)
+        written = os.path.exists(metrics_store_path(ticker, f"{result['year']} {result['quarter']}"))
+        if FINAL_XLSX_EXPORT:
+            written = written and os.path.exists(os.path.join("Final", f"{ticker}.xlsx"))
+        if not (journal_done(ticker, "final_written", final_hash) and written):
+            with instrument.span("save_final", ticker=ticker):
+                save_to_final_excel(ticker, result["year"], result["quarter"], result["extracted"])
+            journal_mark(ticker, "final_written", final_hash)
+        found = True
+        break
     if not found:
         print(f"{ticker} için uygun SEC verisi bulunamadı.")
 
-import yfinance as yf
 
-def fill_dates_and_prices_in_ws(ws_dst):
+def yf_history(code, start, end):
+    import yfinance as yf
+    return replay.recorded_call("yf_history", (code, start, end), lambda: yahoo_call(
+        code, lambda: yf.Ticker(code, session=yahoo_session()).history(start=start, end=end)))
+
+def yf_info(code):
+    import yfinance as yf
+    return replay.recorded_call("yf_info", code, lambda: yahoo_call(
+        code, lambda: dict(yf.Ticker(code, session=yahoo_session()).info)))
+
+def yf_calendar(code):
+    import yfinance as yf
+    return replay.recorded_call("yf_calendar", code, lambda: yahoo_call(
+        code, lambda: yf.Ticker(code, session=yahoo_session()).calendar))
+
+PRICE_START_ROW = 41
+PRICE_END_ROW = 107
+
+def price_window():
+    curr_date = run_today()
+    min_date = curr_date - timedelta(days=(PRICE_END_ROW - PRICE_START_ROW) * 30 + 30)
+    return curr_date, min_date
+
+def get_price_history(ticker_code):
+    curr_date, min_date = price_window()
+    try:
+        hist = yf_history(ticker_code, min_date.strftime("%Y-%m-%d"), (curr_date + timedelta(days=1)).strftime("%Y-%m-%d"))
+        hist = hist.reset_index()
+        if 'Date' in hist:
+            hist['Date'] = hist['Date'].dt.date
+        return hist
+    except Exception as e:
+        return None
+
+def fill_dates_and_prices_in_ws(ws_dst, histories=None):
+    histories = histories or {}
     ticker = ws_dst["B40"].value
     index_ticker = ws_dst["C40"].value
     if not ticker:
@@ -784,22 +1642,11 @@ def fill_dates_and_prices_in_ws(ws_dst):
     if index_ticker.upper().startswith("ARCX:"):
         index_ticker = index_ticker.split(":", 1)[1]
     index_ticker = index_ticker.strip()
-    start_row = 41
-    end_row = 107
-    curr_date = datetime.today().date()
-    min_date = curr_date - timedelta(days=(end_row - start_row) * 30 + 30)
-    def get_hist(ticker_code):
-        try:
-            yf_ticker = yf.Ticker(ticker_code)
-            hist = yf_ticker.history(start=min_date.strftime("%Y-%m-%d"), end=(curr_date + timedelta(days=1)).strftime("%Y-%m-%d"))
-            hist = hist.reset_index()
-            if 'Date' in hist:
-                hist['Date'] = hist['Date'].dt.date
-            return hist
-        except Exception as e:
-            return None
-    hist_company = get_hist(ticker)
-    hist_index = get_hist(index_ticker)
+    start_row = PRICE_START_ROW
+    end_row = PRICE_END_ROW
+    curr_date, min_date = price_window()
+    hist_company = histories[ticker] if ticker in histories else get_price_history(ticker)
+    hist_index = histories[index_ticker] if index_ticker in histories else get_price_history(index_ticker)
     prev_date = curr_date
     for i, row in enumerate(range(start_row, end_row + 1)):
         if i == 0:
@@ -824,89 +1671,409 @@ def fill_dates_and_prices_in_ws(ws_dst):
         ws_dst[f"C{row}"] = price_index if price_index is not None else "Veri yok"
         prev_date = this_date
 
-def create_final2_file_for_ticker(ticker):
-    final_folder = s3_path("Final")
+def get_company_info(ticker):
+    try:
+        return yf_info(ticker)
+    except Exception as e:
+        return {}
+
+def get_tnx_yield():
+    try:
+        return yf_info("^TNX").get("regularMarketPrice", "")
+    except Exception as e:
+        return ""
+
+def get_earnings_date(ticker):
+    import pandas as pd
+    try:
+        cal = yf_calendar(ticker)
+        earning_date = ""
+        if isinstance(cal, pd.DataFrame):
+            if not cal.empty and "Earnings Date" in cal.index:
+                earning_date = cal.loc["Earnings Date"][0]
+        elif isinstance(cal, dict):
+            earning_date = cal.get("Earnings Date", [None])[0]
+        return str(earning_date) if earning_date else ""
+    except Exception as e:
+        return ""
+
+def fetch_yahoo_data(ticker, index_ticker="^GSPC"):
+    return {
+        "histories": {ticker: get_price_history(ticker), index_ticker: get_price_history(index_ticker)},
+        "info": get_company_info(ticker),
+        "tnx": get_tnx_yield(),
+        "earnings_date": get_earnings_date(ticker),
+    }
+
+FORMULA_FILE = "excel python donusum.txt"
+FORMULA_FN = None
+PRICE_FORMULA_FN = None
+PRICE_INPUT_RANGES = ("A41:C107", "E45:F45")
+FORMULA_CELL_REF = re.compile(r'ws\["([A-Z]+[0-9]+)"\]')
+
+def load_formula_ns():
+    with open(FORMULA_FILE, "r", encoding="utf-8") as f:
+        formul_code = f.read()
+    formul_ns = {}
+    exec(compile(formul_code, FORMULA_FILE, "exec"), formul_ns)
+    return formul_code, formul_ns
+
+def load_formula_fn():
+    global FORMULA_FN
+    if FORMULA_FN is None:
+        FORMULA_FN = load_formula_ns()[1]["hesapla_tum_formuller"]
+    return FORMULA_FN
+
+def formula_statements(formul_code):
+    # hesapla_tum_formuller is a flat list of "try: ws[X].value = ... except: ws[X].value = None" blocks.
+    lines = formul_code.split("\ndef ", 2)[0].splitlines()[1:]
+    statements = []
+    for i in range(0, len(lines), 4):
+        block = lines[i:i + 4]
+        if not any(line.strip() for line in block):
+            continue
+        if len(block) < 4 or block[0].strip() != "try:" or block[2].strip() != "except Exception:":
+            raise ValueError(f"{FORMULA_FILE}: beklenmeyen formül bloğu (satır {i + 2})")
+        target, expr = block[1].split("=", 1)
+        statements.append((FORMULA_CELL_REF.search(target).group(1), set(FORMULA_CELL_REF.findall(expr)), block))
+    return statements
+
+def in_cell_ranges(coord, ranges):
+    from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+    row, col = coordinate_to_tuple(coord)
+    for rng in ranges:
+        min_col, min_row, max_col, max_row = range_boundaries(rng)
+        if min_row <= row <= max_row and min_col <= col <= max_col:
+            return True
+    return False
+
+def load_price_formula_fn():
+    # Only the statements downstream of prices, beta/^TNX or TODAY()/NOW() are kept, in file order.
+    # Run over the previous evaluated cells this gives the same result as hesapla_tum_formuller
+    # as long as no kept statement reads a cell before the formula that writes it.
+    global PRICE_FORMULA_FN
+    if PRICE_FORMULA_FN is None:
+        formul_code, formul_ns = load_formula_ns()
+        try:
+            statements = formula_statements(formul_code)
+        except ValueError as e:
+            print(f"⚠️ {e}; fiyat yenilemede tüm formüller hesaplanacak.")
+            PRICE_FORMULA_FN = formul_ns["hesapla_tum_formuller"]
+            return PRICE_FORMULA_FN
+        first_write = {}
+        for idx, (target, _, _) in enumerate(statements):
+            first_write.setdefault(target, idx)
+        affected = set()
+        kept = []
+        for idx, (target, reads, block) in enumerate(statements):
+            volatile = "excel_TODAY(" in block[1] or "excel_NOW(" in block[1]
+            if volatile or any(c in affected or in_cell_ranges(c, PRICE_INPUT_RANGES) for c in reads):
+                if any(first_write.get(c, -1) >= idx for c in reads):
+                    print(f"⚠️ {target} kendinden sonra yazılan bir hücreyi okuyor; fiyat yenilemede tüm formüller hesaplanacak.")
+                    PRICE_FORMULA_FN = formul_ns["hesapla_tum_formuller"]
+                    return PRICE_FORMULA_FN
+                affected.add(target)
+                kept.extend(block)
+        code = "def hesapla_fiyat_formulleri(ws):\n" + "\n".join(kept or ["    pass"]) + "\n"
+        exec(compile(code, FORMULA_FILE, "exec"), formul_ns)
+        PRICE_FORMULA_FN = formul_ns["hesapla_fiyat_formulleri"]
+    return PRICE_FORMULA_FN
+
+def excel_value(v, coerce=False):
+    # Checked when stored, as ws[...].value = v used to: a type openpyxl cannot write raises here (or is
+    # turned into text with coerce=True) instead of failing the whole save; control characters are dropped.
+    if v is None or type(v) in (float, int):
+        return v
+    from openpyxl.cell.cell import get_type, ILLEGAL_CHARACTERS_RE
+    if isinstance(v, bytes):
+        v = v.decode("utf-8", "replace")
+    if get_type(type(v), v) is None:
+        if not coerce:
+            raise ValueError(f"Cannot convert {v!r} to Excel")
+        v = str(v)
+    if isinstance(v, str):
+        v = ILLEGAL_CHARACTERS_RE.sub("", v)
+    return v
+
+class CellRef:
+    __slots__ = ("cells", "coord")
+
+    def __init__(self, cells, coord):
+        self.cells = cells
+        self.coord = coord
+
+    @property
+    def value(self):
+        return self.cells.values.get(self.coord)
+
+    @value.setter
+    def value(self, v):
+        v = excel_value(v)
+        self.cells.values[self.coord] = v
+        self.cells.changed[self.coord] = v
+
+class CellMap:
+    # Minimal ws stand-in for hesapla_tum_formuller: it only uses ws["A1"].value reads and writes.
+    def __init__(self, values):
+        self.values = values
+        self.changed = {}
+
+    def __getitem__(self, coord):
+        return CellRef(self, coord)
+
+    def __setitem__(self, coord, value):
+        CellRef(self, coord).value = value
+
+def evaluate_formulas(cells, prices_only=False):
+    cell_map = CellMap(cells)
+    try:
+        (load_price_formula_fn() if prices_only else load_formula_fn())(cell_map)
+    except Exception as e:
+        pass
+    return cell_map.changed
+
+TEMPLATE_CACHE = {}
+TEMPLATE_CACHE_LOCK = threading.Lock()
+STYLE_ATTRS = ("font", "fill", "border", "alignment", "number_format", "protection")
+# Sheet-level settings a write_only worksheet writes out as-is; page_setup and print area/titles are
+# tied to their worksheet and are carried separately.
+SHEET_ATTRS = ("views", "data_validations", "print_options", "page_margins", "protection", "auto_filter",
+               "sheet_properties", "sheet_format", "row_breaks", "col_breaks", "defined_names", "sheet_state",
+               "HeaderFooter")
+
+class WorkbookTemplate:
+    # Values, styles and sheet layout of the Final2 template as plain data. The openpyxl DOM is
+    # built once per process; every ticker is then streamed out through a write_only workbook.
+    # Templates with drawings, comments, tables or pivots are not streamable and go through the full DOM.
+    def __init__(self, data):
+        import openpyxl
+        from copy import copy, deepcopy
+        self.data = data
+        wb = openpyxl.load_workbook(BytesIO(data), data_only=False)
+        self.active = wb.active.title
+        self.defined_names = deepcopy(wb.defined_names)
+        self.streamable = not wb.chartsheets
+        self.styles = []
+        style_ids = {}
+        self.sheets = []
+        for ws in wb.worksheets:
+            if ws._images or ws._charts or ws._pivots or ws.tables or ws.legacy_drawing:
+                self.streamable = False
+            values = {}
+            cell_styles = {}
+            links = {}
+            for row in ws.iter_rows():
+                for c in row:
+                    if c.value is not None:
+                        values[c.coordinate] = c.value
+                    if c.hyperlink is not None:
+                        links[(c.row, c.column)] = copy(c.hyperlink)
+                    if c.comment is not None:
+                        self.streamable = False
+                    if c.has_style:
+                        key = tuple(c._style)
+                        if key not in style_ids:
+                            style_ids[key] = len(self.styles)
+                            self.styles.append(tuple(copy(getattr(c, a)) if a != "number_format" else c.number_format
+                                                     for a in STYLE_ATTRS))
+                        cell_styles[(c.row, c.column)] = style_ids[key]
+            self.sheets.append({
+                "title": ws.title,
+                "values": values,
+                "styles": cell_styles,
+                "columns": {k: (d.width, d.hidden) for k, d in ws.column_dimensions.items() if d.customWidth or d.hidden},
+                "rows": {k: (d.height, d.hidden) for k, d in ws.row_dimensions.items() if d.height is not None or d.hidden},
+                "merged": [str(r) for r in ws.merged_cells.ranges],
+                "conditional": [(str(cf.sqref), list(cf.rules)) for cf in ws.conditional_formatting],
+                "links": links,
+                "layout": {attr: deepcopy(getattr(ws, attr)) for attr in SHEET_ATTRS},
+                "page_setup": copy(ws.page_setup),
+                "print_area": ws.print_area,
+                "print_titles": (ws.print_title_rows, ws.print_title_cols),
+            })
+
+    def active_values(self):
+        return dict(next(sh["values"] for sh in self.sheets if sh["title"] == self.active))
+
+def load_template(data):
+    key = hashlib.sha256(data).hexdigest()
+    with TEMPLATE_CACHE_LOCK:
+        if key not in TEMPLATE_CACHE:
+            TEMPLATE_CACHE.clear()
+            TEMPLATE_CACHE[key] = WorkbookTemplate(data)
+        return TEMPLATE_CACHE[key]
+
+def write_workbook_full(template, values_by_sheet):
+    import openpyxl
+    from openpyxl.cell.cell import MergedCell
+    wb = openpyxl.load_workbook(BytesIO(template.data), data_only=False)
+    for title, values in values_by_sheet.items():
+        ws = wb[title]
+        for coord, value in values.items():
+            cell = ws[coord]
+            if not isinstance(cell, MergedCell):
+                cell.value = value
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def write_workbook_from_template(template, values_by_sheet):
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils.cell import coordinate_to_tuple
+    from copy import copy, deepcopy
+    if not template.streamable:
+        return write_workbook_full(template, values_by_sheet)
+    wb = openpyxl.Workbook(write_only=True)
+    wb.defined_names = deepcopy(template.defined_names)
+    # Registering a style with the workbook hashes every style object, so each template style is
+    # registered once and later cells just copy the resulting index array.
+    style_arrays = {}
+    for sheet in template.sheets:
+        ws = wb.create_sheet(sheet["title"])
+        for letter, (width, hidden) in sheet["columns"].items():
+            ws.column_dimensions[letter].width = width
+            ws.column_dimensions[letter].hidden = hidden
+        for idx, (height, hidden) in sheet["rows"].items():
+            ws.row_dimensions[idx].height = height
+            ws.row_dimensions[idx].hidden = hidden
+        for rng in sheet["merged"]:
+            ws.merged_cells.add(rng)
+        for attr, value in sheet["layout"].items():
+            setattr(ws, attr, deepcopy(value))
+        ws.page_setup = copy(sheet["page_setup"])
+        ws.page_setup._parent = ws
+        if sheet["print_area"]:
+            ws.print_area = sheet["print_area"]
+        ws.print_title_rows, ws.print_title_cols = sheet["print_titles"]
+        for sqref, rules in sheet["conditional"]:
+            for rule in rules:
+                ws.conditional_formatting.add(sqref, rule)
+        grid = {}
+        for coord, value in values_by_sheet.get(sheet["title"], sheet["values"]).items():
+            r, c = coordinate_to_tuple(coord)
+            grid.setdefault(r, {})[c] = value
+        for r, c in list(sheet["styles"]) + list(sheet["links"]):
+            grid.setdefault(r, {}).setdefault(c, None)
+        for r in range(1, max(grid, default=0) + 1):
+            row = grid.get(r, {})
+            out = [None] * max(row, default=0)
+            for c, value in row.items():
+                style = sheet["styles"].get((r, c))
+                link = sheet["links"].get((r, c))
+                if style is None and link is None:
+                    out[c - 1] = value
+                    continue
+                cell = WriteOnlyCell(ws, value=value)
+                if link is not None:
+                    cell._hyperlink = copy(link)
+                if style in style_arrays:
+                    cell._style = copy(style_arrays[style])
+                elif style is not None:
+                    for attr, v in zip(STYLE_ATTRS, template.styles[style]):
+                        setattr(cell, attr, v)
+                    style_arrays[style] = copy(cell._style)
+                out[c - 1] = cell
+            ws.append(out)
+    wb.active = next(i for i, sh in enumerate(template.sheets) if sh["title"] == template.active)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+FINAL2_CELLS_DIR = "Final2Cells"
+
+def final2_cells_path(ticker):
+    return os.path.join(FINAL2_CELLS_DIR, f"{ticker}.pkl")
+
+def save_final2_cells(ticker, cells, path=None):
+    # Evaluated Final2 cells, kept locally so a prices-only refresh starts from them without opening a workbook.
+    import pickle
+    path = path or final2_cells_path(ticker)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        pickle.dump(cells, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+def load_final2_cells(ticker):
+    import pickle
+    path = final2_cells_path(ticker)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    key = s3_path(f"Final2/{ticker}.xlsx")
+    if not s3_exists(key):
+        return None
+    return read_final_values(s3_read_bytes(key), max_row=None, max_col=None)
+
+def workbook_value(value):
+    # The value upload_to_db would read back from a saved Final2: numbers go through openpyxl's
+    # "%.16g" and come back as int when they have no fraction part, dates come back as datetimes.
+    import numbers
+    from datetime import date, time as dtime
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, numbers.Real):
+        if math.isnan(value) or math.isinf(value):
+            return None
+        text = "%.16g" % value
+        return float(text) if any(ch in text for ch in ".eE") else int(text)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.combine(value, dtime())
+    if isinstance(value, str) and value.startswith("="):
+        return None
+    return value
+
+def cell_range_values(cells, first, last):
+    from openpyxl.utils import get_column_letter
+    from openpyxl.utils.cell import coordinate_to_tuple
+    min_row, min_col = coordinate_to_tuple(first)
+    max_row, max_col = coordinate_to_tuple(last)
+    return [[workbook_value(cells.get(f"{get_column_letter(c)}{r}")) for c in range(min_col, max_col + 1)]
+            for r in range(min_row, max_row + 1)]
+
+def create_final2_file_for_ticker(ticker, yahoo=None, template_bytes=None):
     final2_folder = s3_path("Final2")
     template_path = s3_path("Companies1/donusturucu.xlsx")
-    src_key = s3_path(f"Final/{ticker}.xlsx")
-    if not s3_exists(src_key):
+    if not os.path.isdir(metrics_store_path(ticker)):
         return
-    if not s3_exists(template_path):
+    if template_bytes is None and not s3_exists(template_path):
         return
     try:
-        wb_src = openpyxl.load_workbook(BytesIO(s3_read_bytes(src_key)), data_only=True)
-        ws_src = wb_src.active
-        dst_key = s3_path(f"Final2/{ticker}.xlsx")
-        template_bytes = s3_read_bytes(template_path)
-        s3_write_bytes(dst_key, template_bytes)
-        wb_dst = openpyxl.load_workbook(BytesIO(template_bytes), data_only=False)
-        ws_dst = wb_dst.active
-        from openpyxl.utils import column_index_from_string
-        max_col = column_index_from_string("BG")
-        max_row = 36
-        for r in range(1, max_row + 1):
-            for c in range(1, max_col + 1):
-                src_val = ws_src.cell(row=r, column=c).value
-                if src_val is not None:
-                    ws_dst.cell(row=r, column=c).value = src_val
-        ws_dst["B40"].value = ticker
-        ws_dst["C40"].value = "^GSPC"
-        fill_dates_and_prices_in_ws(ws_dst)
-        yf_ticker = yf.Ticker(ticker)
-        try:
-            ws_dst["E41"].value = yf_ticker.info.get("sector", "")
-        except Exception as e:
-            ws_dst["E41"].value = ""
-        try:
-            ws_dst["F41"].value = yf_ticker.info.get("industry", "")
-        except Exception as e:
-            ws_dst["F41"].value = ""
-        try:
-            ws_dst["G41"].value = yf_ticker.info.get("fullTimeEmployees", "")
-        except Exception as e:
-            ws_dst["G41"].value = ""
-        try:
-            summary = yf_ticker.info.get("longBusinessSummary", yf_ticker.info.get("summary", ""))
-            ws_dst["H41"].value = summary
-        except Exception as e:
-            ws_dst["H41"].value = ""
-        try:
-            ws_dst["E45"].value = yf_ticker.info.get("beta", "")
-        except Exception as e:
-            ws_dst["E45"].value = ""
-        try:
-            tnx_ticker = yf.Ticker("^TNX")
-            tnx_yield = tnx_ticker.info.get("regularMarketPrice", "")
-            ws_dst["F45"].value = tnx_yield
-        except Exception as e:
-            ws_dst["F45"].value = ""
-        try:
-            cal = yf_ticker.calendar
-            earning_date = ""
-            if isinstance(cal, pd.DataFrame):
-                if not cal.empty and "Earnings Date" in cal.index:
-                    earning_date = cal.loc["Earnings Date"][0]
-            elif isinstance(cal, dict):
-                earning_date = cal.get("Earnings Date", [None])[0]
-            ws_dst["I41"].value = str(earning_date) if earning_date else ""
-        except Exception as e:
-            ws_dst["I41"].value = ""
-        try:
-            with open("excel python donusum.txt", "r", encoding="utf-8") as f:
-                formul_code = f.read()
-            formul_ns = {}
-            exec(formul_code, formul_ns)
-            formul_ns["hesapla_tum_formuller"](ws_dst)
-        except Exception as e:
-            pass
-        buffer = BytesIO()
-        wb_dst.save(buffer)
-        buffer.seek(0)
-        s3_write_bytes(dst_key, buffer.read())
+        with instrument.span("final2_load", ticker=ticker):
+            dst_key = s3_path(f"Final2/{ticker}.xlsx")
+            if template_bytes is None:
+                template_bytes = s3_read_bytes(template_path)
+            s3_write_bytes(dst_key, template_bytes)
+            template = load_template(template_bytes)
+            cells = template.active_values()
+            cells.update(final_values_from_store(ticker))
+        ws_dst = CellMap(cells)
+        ws_dst["B40"] = ticker
+        ws_dst["C40"] = "^GSPC"
+        if yahoo is None:
+            with instrument.span("yahoo_fetch", ticker=ticker):
+                yahoo = fetch_yahoo_data(ticker, ws_dst["C40"].value)
+        fill_dates_and_prices_in_ws(ws_dst, yahoo["histories"])
+        info = yahoo["info"]
+        ws_dst["E41"] = excel_value(info.get("sector", ""), coerce=True)
+        ws_dst["F41"] = excel_value(info.get("industry", ""), coerce=True)
+        ws_dst["G41"] = excel_value(info.get("fullTimeEmployees", ""), coerce=True)
+        ws_dst["H41"] = excel_value(info.get("longBusinessSummary", info.get("summary", "")), coerce=True)
+        ws_dst["E45"] = excel_value(info.get("beta", ""), coerce=True)
+        ws_dst["F45"] = excel_value(yahoo["tnx"], coerce=True)
+        ws_dst["I41"] = excel_value(yahoo["earnings_date"], coerce=True)
+        with instrument.span("formulas", ticker=ticker):
+            cells.update(run_cpu(evaluate_formulas, {k: v for k, v in cells.items() if v is not None}))
+        with instrument.span("final2_save", ticker=ticker):
+            final2_bytes = write_workbook_from_template(template, {template.active: cells})
+            s3_write_bytes(dst_key, final2_bytes)
+        save_final2_cells(ticker, cells)
+        return final2_bytes
     except Exception as e:
         pass
 
 def get_data_from_excel(filepath, range_tuple):
+    import openpyxl
     wb = openpyxl.load_workbook(BytesIO(s3_read_bytes(filepath)), data_only=True)
     ws = wb.active
     start_col, start_row = range_tuple[0][0], int(range_tuple[0][1:])
@@ -932,8 +2099,9 @@ def insert_company_info_to_db(cursor, ticker, sector, industry, employees, earni
             market_cap=EXCLUDED.market_cap
     """
     cursor.execute(sql, (ticker, sector, industry, employees, earnings_date, summary, radar, market_cap))
+    instrument.inc("tarama_db_rows_total", table="company_info")
 
-def insert_data_to_db(cursor, ticker, data):
+def excel_metric_rows(ticker, data):
     headers = data[0]
     for row in data[1:]:
         metric = row[0]
@@ -944,36 +2112,51 @@ def insert_data_to_db(cursor, ticker, data):
                 continue
             if value is None or str(value).strip() == "" or str(value).startswith("#VALUE"):
                 continue
-            sql = """
-            INSERT INTO excel_metrics (ticker, metric, period, value)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (ticker, metric, period)
-            DO UPDATE SET value = EXCLUDED.value
-            """
-            cursor.execute(sql, (ticker, metric, period, str(value) if value is not None else None))
+            yield (ticker, metric, period, str(value))
+
+def insert_data_to_db(cursor, ticker, data):
+    for params in excel_metric_rows(ticker, data):
+        sql = """
+        INSERT INTO excel_metrics (ticker, metric, period, value)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (ticker, metric, period)
+        DO UPDATE SET value = EXCLUDED.value
+        """
+        cursor.execute(sql, params)
+        instrument.inc("tarama_db_rows_total", table="excel_metrics")
+
+DB_PAGE_ROWS = int(os.getenv("DB_PAGE_ROWS", "1000"))
+
+def bulk_upsert_metrics(cursor, rows, page_rows=DB_PAGE_ROWS):
+    # One multi-row INSERT per page instead of a round trip per cell. ON CONFLICT cannot touch
+    # the same key twice in one statement, so duplicates are collapsed first (last one wins).
+    rows = list({row[:3]: row for row in rows}.values())
+    for i in range(0, len(rows), page_rows):
+        page = rows[i:i + page_rows]
+        sql = f"""
+        INSERT INTO excel_metrics (ticker, metric, period, value)
+        VALUES {", ".join(["(%s, %s, %s, %s)"] * len(page))}
+        ON CONFLICT (ticker, metric, period)
+        DO UPDATE SET value = EXCLUDED.value
+        """
+        cursor.execute(sql, [v for row in page for v in row])
+    instrument.inc("tarama_db_rows_total", len(rows), table="excel_metrics")
+    return len(rows)
 
 def upload_to_db(ticker):
-    db_user = os.getenv("DB_USER")
-    db_pass = os.getenv("DB_PASS")
-    db_host = os.getenv("DB_HOST")
-    db_port = os.getenv("DB_PORT", "5432")
-    db_name = os.getenv("DB_NAME")
-    conn = psycopg2.connect(
-        host=db_host,
-        port=db_port,
-        user=db_user,
-        password=db_pass,
-        dbname=db_name
-    )
+    import openpyxl
+    conn = db_connect()
     cursor = conn.cursor()
     fpath = s3_path(f"Final2/{ticker}.xlsx")
     if not s3_exists(fpath):
-        return
+        return False
+    uploaded = False
     try:
         EXCEL_RANGE = ('A191', 'O202')
         data = get_data_from_excel(fpath, EXCEL_RANGE)
-        insert_data_to_db(cursor, ticker, data)
-        conn.commit()
+        with instrument.span("db_insert", ticker=ticker):
+            insert_data_to_db(cursor, ticker, data)
+            conn.commit()
         wb = openpyxl.load_workbook(BytesIO(s3_read_bytes(fpath)), data_only=True)
         ws = wb.active
         sector = ws["B204"].value
@@ -987,10 +2170,243 @@ def upload_to_db(ticker):
                                   int(radar) if radar is not None else None,
                                   int(market_cap) if market_cap is not None else None)
         conn.commit()
+        uploaded = True
     except Exception as e:
         pass
     cursor.close()
     conn.close()
+    return uploaded
+
+ASYNC_LIMITS = {
+    "yahoo": int(os.getenv("ASYNC_YAHOO", "4")),
+    "s3": int(os.getenv("ASYNC_S3", "8")),
+    "db": int(os.getenv("ASYNC_DB", "2")),
+    "cpu": int(os.getenv("ASYNC_CPU", str(CPU_WORKERS))),
+}
+# Enough tickers in flight to keep every SEC slot and every CPU worker busy at the same time.
+ASYNC_TICKERS = int(os.getenv("ASYNC_TICKERS", str(max(4, CPU_WORKERS + SEC_CONCURRENCY))))
+
+async def in_service(semaphores, service, fn, *args):
+    import asyncio
+    async with semaphores[service]:
+        return await asyncio.to_thread(fn, *args)
+
+async def fetch_market_data_async(semaphores, index_ticker="^GSPC"):
+    import asyncio
+    hist_index, tnx = await asyncio.gather(
+        in_service(semaphores, "yahoo", get_price_history, index_ticker),
+        in_service(semaphores, "yahoo", get_tnx_yield),
+    )
+    return {"index_ticker": index_ticker, "hist_index": hist_index, "tnx": tnx}
+
+async def fetch_yahoo_data_async(semaphores, ticker, market):
+    import asyncio
+    hist_company, info, earnings_date, market = await asyncio.gather(
+        in_service(semaphores, "yahoo", get_price_history, ticker),
+        in_service(semaphores, "yahoo", get_company_info, ticker),
+        in_service(semaphores, "yahoo", get_earnings_date, ticker),
+        market,
+    )
+    return {
+        "histories": {ticker: hist_company, market["index_ticker"]: market["hist_index"]},
+        "info": info,
+        "tnx": market["tnx"],
+        "earnings_date": earnings_date,
+    }
+
+def read_local_final(ticker):
+    path = os.path.join("Final", f"{ticker}.xlsx")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+async def run_ticker_async(semaphores, ticker, market, template):
+    import asyncio
+    # SEC/Chrome extraction, Yahoo lookups and the template download run side by side;
+    # Final2 only waits for whichever of them finishes last.
+    # process_ticker takes SEC_SLOTS itself around SEC/Chrome work and releases it for the CPU stage.
+    sec_task = asyncio.create_task(asyncio.to_thread(process_ticker, ticker))
+    yahoo_task = asyncio.create_task(fetch_yahoo_data_async(semaphores, ticker, market))
+    try:
+        await sec_task
+        if FINAL_XLSX_EXPORT:
+            final_bytes = read_local_final(ticker)
+            if final_bytes is not None:
+                await in_service(semaphores, "s3", s3_write_bytes, f"Final/{ticker}.xlsx", final_bytes)
+        template_bytes = await template
+        if template_bytes is None:
+            return
+        # Final2 also depends on the day's prices, so a finished Final2 is only reused on the same run day.
+        final2_hash = journal_hash(metrics_store_digest(ticker), template_bytes, run_today())
+        done, final2_sha = journal_output(ticker, "final2_computed", final2_hash)
+        if not done:
+            yahoo = await yahoo_task
+            final2_bytes = await in_service(semaphores, "cpu", create_final2_file_for_ticker, ticker, yahoo, template_bytes)
+            if final2_bytes is None:
+                return
+            final2_sha = hashlib.sha256(final2_bytes).hexdigest()
+            journal_mark(ticker, "final2_computed", final2_hash, final2_sha)
+        db_hash = journal_hash(final2_sha)
+        if journal_done(ticker, "db_uploaded", db_hash):
+            return
+        if await in_service(semaphores, "db", upload_to_db, ticker):
+            journal_mark(ticker, "db_uploaded", db_hash)
+    finally:
+        # Also when the SEC side raises TickerFailed: the requeued attempt starts its own Yahoo fetch.
+        yahoo_task.cancel()
+
+async def run_batch_async(tickers):
+    import asyncio
+    # Threads waiting on SEC_SLOTS must not starve Yahoo/S3/DB calls of executor threads.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_TICKERS + SEC_CONCURRENCY + sum(ASYNC_LIMITS.values())))
+    semaphores = {name: asyncio.Semaphore(limit) for name, limit in ASYNC_LIMITS.items()}
+    market = asyncio.ensure_future(fetch_market_data_async(semaphores))
+    template_path = "Companies1/donusturucu.xlsx"
+    template = asyncio.ensure_future(in_service(semaphores, "s3", lambda: s3_read_bytes(template_path) if s3_exists(template_path) else None))
+    in_flight = asyncio.Semaphore(ASYNC_TICKERS)
+    async def one(ticker):
+        for attempt in range(TICKER_RETRIES + 1):
+            try:
+                async with in_flight:
+                    with instrument.span("ticker_async", profile=False, ticker=ticker):
+                        await run_ticker_async(semaphores, ticker, asyncio.shield(market), asyncio.shield(template))
+                return
+            except TickerFailed as e:
+                if attempt == TICKER_RETRIES:
+                    raise
+                # The slot is released while waiting, so the rest of the batch keeps running.
+                delay = retry_delay(attempt, e.retry_after)
+                print(f"🔁 {ticker}: {e} - {delay:.0f} sn sonra yeniden kuyruğa alınıyor.")
+                instrument.inc("tarama_ticker_requeues_total")
+                await asyncio.sleep(delay)
+    results = await asyncio.gather(*(one(t) for t in tickers), return_exceptions=True)
+    for ticker, res in zip(tickers, results):
+        if isinstance(res, BaseException):
+            print(f"❌ {ticker}: {res}")
+    return results
+
+def run_final_export(tickers):
+    # On-demand Final/<ticker>.xlsx from the metrics store, for people who still open the workbook.
+    for ticker in [normalize_ticker(t) for t in tickers]:
+        if not os.path.isdir(metrics_store_path(ticker)):
+            print(f"⏭️ {ticker}: metrik deposu yok.")
+            continue
+        with instrument.span("final_export", ticker=ticker):
+            path = export_final_excel(ticker)
+            with open(path, "rb") as f:
+                s3_write_bytes(f"Final/{ticker}.xlsx", f.read())
+        print(f"📄 {ticker}: {path} yazıldı.")
+
+def run_batch(tickers):
+    import asyncio
+    return asyncio.run(run_batch_async([normalize_ticker(t) for t in tickers]))
+
+METRICS_RANGE = ("A191", "O202")
+COMPANY_RANGE = ("B209", "B210")
+
+def refresh_ticker_prices(ticker, market):
+    cells = load_final2_cells(ticker)
+    if cells is None:
+        print(f"⏭️ {ticker}: Final2 yok, önce tam çalıştırma gerekli.")
+        return None
+    old_rows = set(excel_metric_rows(ticker, cell_range_values(cells, *METRICS_RANGE)))
+    old_company = cell_range_values(cells, *COMPANY_RANGE)
+    ws = CellMap(cells)
+    with instrument.span("yahoo_fetch", ticker=ticker):
+        fill_dates_and_prices_in_ws(ws, {market["index_ticker"]: market["hist_index"]})
+    ws["F45"] = market["tnx"]
+    with instrument.span("formulas_prices", ticker=ticker):
+        cells.update(evaluate_formulas(cells, prices_only=True))
+    rows = [row for row in excel_metric_rows(ticker, cell_range_values(cells, *METRICS_RANGE)) if row not in old_rows]
+    company = cell_range_values(cells, *COMPANY_RANGE)
+    radar, market_cap = company[0][0], company[1][0]
+    # Staged next to the live cache and only promoted once the DB transaction has committed.
+    save_final2_cells(ticker, cells, final2_cells_path(ticker) + ".new")
+    return {
+        "rows": rows,
+        "company": None if company == old_company else (int(radar) if radar is not None else None,
+                                                        int(market_cap) if market_cap is not None else None, ticker),
+    }
+
+def write_final2_from_cells(ticker, template):
+    import pickle
+    with open(final2_cells_path(ticker), "rb") as f:
+        cells = pickle.load(f)
+    s3_write_bytes(f"Final2/{ticker}.xlsx", write_workbook_from_template(template, {template.active: cells}))
+
+def run_price_refresh(tickers=None, write_workbooks=False):
+    # Daily after-close refresh: no SEC, no workbook parsing; only the price-dependent formulas are
+    # re-run and the excel_metrics rows that changed go to the DB in a single transaction.
+    if not tickers:
+        tickers = [os.path.splitext(os.path.basename(k))[0] for k in s3_list_dir("Final2/") if k.endswith(".xlsx")]
+    tickers = [normalize_ticker(t) for t in tickers]
+    if not tickers:
+        return {}
+    index_ticker = "^GSPC"
+    market = {"index_ticker": index_ticker, "hist_index": get_price_history(index_ticker), "tnx": get_tnx_yield()}
+    load_price_formula_fn()
+    results = {}
+    with instrument.span("price_refresh"):
+        with ThreadPoolExecutor(max_workers=min(ASYNC_LIMITS["yahoo"], len(tickers))) as ex:
+            futures = {ex.submit(refresh_ticker_prices, t, market): t for t in tickers}
+            for fut in as_completed(futures):
+                ticker = futures[fut]
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    print(f"❌ {ticker}: {e}")
+                    continue
+                if res is not None:
+                    results[ticker] = res
+        rows = [row for res in results.values() for row in res["rows"]]
+        companies = [res["company"] for res in results.values() if res["company"] is not None]
+        conn = db_connect()
+        cursor = conn.cursor()
+        try:
+            with instrument.span("db_bulk_load"):
+                n_rows = bulk_upsert_metrics(cursor, rows)
+                for params in companies:
+                    cursor.execute("UPDATE company_info SET radar = %s, market_cap = %s WHERE ticker = %s", params)
+                instrument.inc("tarama_db_rows_total", len(companies), table="company_info")
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            for ticker in results:
+                os.remove(final2_cells_path(ticker) + ".new")
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        for ticker in results:
+            os.replace(final2_cells_path(ticker) + ".new", final2_cells_path(ticker))
+        if write_workbooks:
+            template = load_template(s3_read_bytes("Companies1/donusturucu.xlsx"))
+            with ThreadPoolExecutor(max_workers=min(S3_MAX_WORKERS, len(results) or 1)) as ex:
+                for ticker, fut in [(t, ex.submit(write_final2_from_cells, t, template)) for t in results]:
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        print(f"📤 {ticker} Final2 yazılamadı: {e}")
+    print(f"💹 Fiyat yenileme: {len(results)}/{len(tickers)} şirket, {n_rows} metrik satırı, {len(companies)} şirket bilgisi güncellendi.")
+    return results
 
 if __name__ == "__main__":
-    main()
+    if "--profile" in sys.argv:
+        instrument.enable_profiling(os.getenv("PROFILE") or "1")
+    instrument.set_profile_uploader(s3_write_bytes)
+    try:
+        if "--refresh-prices" in sys.argv:
+            run_price_refresh([a for a in sys.argv[sys.argv.index("--refresh-prices") + 1:] if not a.startswith("--")],
+                              write_workbooks="--workbooks" in sys.argv)
+        elif "--export-final" in sys.argv:
+            run_final_export([a for a in sys.argv[sys.argv.index("--export-final") + 1:] if not a.startswith("--")])
+        elif "--batch" in sys.argv:
+            run_batch([a for a in sys.argv[sys.argv.index("--batch") + 1:] if not a.startswith("--")])
+        else:
+            main()
+    finally:
+        # trigger.py re-runs this file in one process; each run would otherwise leave its workers behind.
+        shutdown_cpu_pool()
+        instrument.flush()